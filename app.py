@@ -3,8 +3,25 @@ import pandas as pd
 from datetime import datetime, timedelta
 import os
 import json
+import math
+import time
+import base64
+import argparse
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
 import google.generativeai as genai
 
+try:
+    import ijson
+    STREAMING_AVAILABLE = True
+except ImportError:
+    STREAMING_AVAILABLE = False
+
+import attendance_store
+import attendance_db
+
 # --- 1. 配置區 ---
 CHURCH_ID = 2523 
 ACCOUNT = "h81s2"
@@ -12,12 +29,28 @@ PASSWORD = "h81"
 ORG_LEVEL = "2-2994,2-2993,2-2995" 
 DATA_FOLDER_EXCEL = "reports_excel"      # 格式化報表 (Excel)
 DATA_FOLDER_SUMMARY_EXCEL = "reports_summary"
+# 總結數據已改由個人明細即時彙總，總結 Excel 僅為選用的匯出檔
+EXPORT_SUMMARY_EXCEL = os.environ.get("EXPORT_SUMMARY_EXCEL", "1") == "1"
 
 # API 端點
 BASE_URL = "https://backend.chlife-stat.org"
 LOGIN_URL = f"{BASE_URL}/api/login"
 DATA_URL = f"{BASE_URL}/api/church/member"
 
+# 分頁抓取設定
+PAGE_SIZE = 5000
+FETCH_MAX_WORKERS = int(os.environ.get("FETCH_MAX_WORKERS", 4))  # 同時抓取的頁數上限
+FETCH_MAX_PAGES = int(os.environ.get("FETCH_MAX_PAGES", 100))  # API 未回傳總筆數時的分頁上限
+TOTAL_COUNT_KEYS = ('total', 'totalCount', 'total_count', 'count')  # API 回傳總筆數可能使用的欄位
+# 串流解析：逐筆讀取 data.members 並直接填入欄位緩衝區，避免原始 JSON、dict 清單與 DataFrame 同時存在記憶體
+STREAM_PARSE = os.environ.get("STREAM_PARSE", "1") == "1" and STREAMING_AVAILABLE
+BACKFILL_MAX_WORKERS = int(os.environ.get("BACKFILL_MAX_WORKERS", 4))  # 回補歷史時同時處理的週數上限
+
+# Token 快取設定
+TOKEN_CACHE_FILE = os.environ.get("TOKEN_CACHE_FILE")  # 選用：設定後會將 Token 快取到磁碟，跨行程重用
+TOKEN_REFRESH_MARGIN = 300   # 到期前幾秒就重新登入 (秒)
+TOKEN_DEFAULT_TTL = 3600     # 無法解析 Token 到期時間時的預設有效期 (秒)
+
 # --- 欄位對應與輸出格式定義 (最終確認修正) ---
 ATTEND_MAP = {
     # 🚨 關鍵修正: 假設您所需的小區名稱在 API 的 lv3_name 中
@@ -64,7 +97,76 @@ def get_church_week_info(target_date=None):
     
     return year, week, sunday_date.strftime("%Y-%m-%d")
 
-def get_auth_token():
+def iter_church_weeks(start_date, end_date):
+    """
+    列出日期區間內的所有召會週次 (含頭尾所在的週)。
+    :param start_date: 起始日期 (date 或 'YYYY-MM-DD')
+    :param end_date: 結束日期 (date 或 'YYYY-MM-DD')
+    :return: [(year, week, sunday_date_str), ...]，由舊到新排序
+    """
+    if isinstance(start_date, str):
+        start_date = datetime.strptime(start_date, "%Y-%m-%d").date()
+    if isinstance(end_date, str):
+        end_date = datetime.strptime(end_date, "%Y-%m-%d").date()
+    if start_date > end_date:
+        start_date, end_date = end_date, start_date
+
+    weeks = []
+    current = start_date
+    while True:
+        week_info = get_church_week_info(current)
+        if week_info[2] > end_date.strftime("%Y-%m-%d"):
+            break
+        if not weeks or weeks[-1] != week_info:
+            weeks.append(week_info)
+        current += timedelta(days=7)
+    return weeks
+
+_token_cache = {"token": None, "exp": 0}
+_token_lock = threading.Lock()
+
+
+def _decode_jwt_expiry(token):
+    """解析 JWT payload 中的 exp (Unix 秒)，無法解析時回傳 None。"""
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+        return float(claims['exp'])
+    except Exception:
+        return None
+
+
+def _token_is_fresh(exp):
+    return exp - TOKEN_REFRESH_MARGIN > time.time()
+
+
+def _load_token_from_disk():
+    if not TOKEN_CACHE_FILE or not os.path.exists(TOKEN_CACHE_FILE):
+        return None, 0
+    try:
+        with open(TOKEN_CACHE_FILE, encoding='utf-8') as f:
+            cached = json.load(f)
+        return cached.get('token'), float(cached.get('exp', 0))
+    except Exception as e:
+        print(f"讀取 Token 快取檔失敗: {e}")
+        return None, 0
+
+
+def _save_token_to_disk(token, exp):
+    if not TOKEN_CACHE_FILE:
+        return
+    try:
+        tmp_path = f"{TOKEN_CACHE_FILE}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"token": token, "exp": exp}, f)
+        os.chmod(tmp_path, 0o600)
+        os.replace(tmp_path, TOKEN_CACHE_FILE)
+    except Exception as e:
+        print(f"寫入 Token 快取檔失敗: {e}")
+
+
+def _login():
     """執行登入並獲取 JWT Token。"""
     print("嘗試登入...")
     login_payload = {"church_id": CHURCH_ID, "account": ACCOUNT, "pwd": PASSWORD}
@@ -79,6 +181,56 @@ def get_auth_token():
         print(f"登入失敗，請檢查帳密或網路：{e}")
         return None
 
+
+def get_auth_token(force_refresh=False, stale_token=None):
+    """
+    取得 JWT Token：優先使用記憶體 (及選用的磁碟) 快取，快到期時才重新登入。
+    :param force_refresh: 強制重新登入 (例如 API 回傳 401 時)。
+    :param stale_token: 已確認失效的 Token；若快取已被其他執行緒換新則直接沿用，不重複登入。
+    """
+    with _token_lock:
+        cached_token = _token_cache["token"]
+        if force_refresh and cached_token and cached_token != stale_token:
+            return cached_token
+
+        if not force_refresh:
+            if cached_token and _token_is_fresh(_token_cache["exp"]):
+                return cached_token
+            disk_token, disk_exp = _load_token_from_disk()
+            if disk_token and _token_is_fresh(disk_exp):
+                _token_cache.update(token=disk_token, exp=disk_exp)
+                return disk_token
+
+        token = _login()
+        if not token:
+            return None
+        exp = _decode_jwt_expiry(token) or (time.time() + TOKEN_DEFAULT_TTL)
+        _token_cache.update(token=token, exp=exp)
+        _save_token_to_disk(token, exp)
+        return token
+
+
+def _current_token(token):
+    """快取中的 Token 若已被 (其他頁面的 401 重試) 換新則改用新的，避免後續請求再帶著失效的 Token。"""
+    with _token_lock:
+        return _token_cache["token"] or token
+
+
+def _authorized_get(url, token, params, stream=False):
+    """帶 Token 的 GET；若回傳 401 則重新登入後再試一次。"""
+    headers = {"Authorization": f"Bearer {token}", "Accept": "application/json"}
+    response = requests.get(url, headers=headers, params=params, stream=stream)
+    if response.status_code == 401:
+        print("Token 已失效，重新登入...")
+        response.close()
+        new_token = get_auth_token(force_refresh=True, stale_token=token)
+        if new_token:
+            headers["Authorization"] = f"Bearer {new_token}"
+            response = requests.get(url, headers=headers, params=params, stream=stream)
+    response.raise_for_status()
+    return response
+
+
 def format_dataframe_for_output(df):
     """
     將原始 DataFrame 格式化。確保 'lv3_name' 成為最終的 '區別' 欄位。
@@ -91,8 +243,8 @@ def format_dataframe_for_output(df):
         if col not in df_formatted.columns:
             df_formatted[col] = 0
 
-    # 2. 數據清洗：填補空值並轉為整數
-    df_formatted[api_attend_cols] = df_formatted[api_attend_cols].fillna(0).astype(int)
+    # 2. 數據清洗：填補空值並轉為整數 (最終型別由 compact_member_frame 統一轉為 uint8)
+    df_formatted[api_attend_cols] = df_formatted[api_attend_cols].fillna(0)
     
     # 3. 重新命名欄位
     df_formatted = df_formatted.rename(columns=ATTEND_MAP)
@@ -104,63 +256,228 @@ def format_dataframe_for_output(df):
     # 組合最終的 DataFrame
     final_cols = [col for col in EXCEL_COLUMNS_ORDER if col in df_formatted.columns]
 
-    # 返回包含所有必要欄位的 DataFrame (僅包含 Excel 報表欄位)
-    return df_formatted[final_cols]
+    # 返回包含所有必要欄位的 DataFrame (僅包含 Excel 報表欄位)，並轉為精簡型別
+    return attendance_store.compact_member_frame(df_formatted[final_cols])
 
 
-def fetch_weekly_data(token, year, week, week_start_date_str):
-    """使用 Token 抓取數據，格式化並存檔為 Excel。"""
-    
-    params = {
+def _extract_total_count(data):
+    """從 API 回傳的 data 區塊找出成員總數，找不到則回傳 None。"""
+    containers = [data, data.get('pagination') or {}, data.get('meta') or {}]
+    for container in containers:
+        if not isinstance(container, dict):
+            continue
+        for key in TOTAL_COUNT_KEYS:
+            value = container.get(key)
+            if isinstance(value, (int, float)) or (isinstance(value, str) and value.isdigit()):
+                return int(value)
+    return None
+
+
+def _member_params(year, week, page):
+    return {
         "level": ORG_LEVEL, "meeting": "", "year": year, "week": week,
-        "limit": 5000, "page": 1, "memberId": "", "memberName": "",
+        "limit": PAGE_SIZE, "page": page, "memberId": "", "memberName": "",
         "sex": "", "role": "", "filter_mode": "churchStructureTab",
         "lastWeekCopy": 0, "timeChange": True
     }
-    headers = {"Authorization": f"Bearer {token}", "Accept": "application/json"}
+
+
+def _to_attend_value(value):
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _stream_members(raw_stream):
+    """
+    以 ijson 逐一讀取 data.members 陣列，只保留 ATTEND_MAP 需要的欄位。
+    字串欄位存入 list，出席欄位存入 array('h')，最後零複製轉成 DataFrame。
+    :return: (總筆數或 None, 成員 DataFrame)
+    """
+    string_keys = [k for k in ATTEND_MAP if not k.startswith('attend')]
+    attend_keys = [k for k in ATTEND_MAP if k.startswith('attend')]
+    string_buffers = {k: [] for k in string_keys}
+    attend_buffers = {k: array('h') for k in attend_keys}
+    total_prefixes = {f"{container}.{key}" for container in ('data', 'data.pagination', 'data.meta') for key in TOTAL_COUNT_KEYS}
+
+    item_prefix = 'data.members.item'
+    row = None
+    total = None
+    for prefix, event, value in ijson.parse(raw_stream):
+        if prefix == item_prefix:
+            if event == 'start_map':
+                row = {}
+            elif event == 'end_map' and row is not None:
+                for k in string_keys:
+                    string_buffers[k].append(row.get(k))
+                for k in attend_keys:
+                    attend_buffers[k].append(_to_attend_value(row.get(k)))
+                row = None
+        elif row is not None and prefix.startswith(item_prefix):
+            key = prefix[len(item_prefix) + 1:]
+            if key in ATTEND_MAP and event in ('string', 'number', 'boolean', 'null'):
+                row[key] = value
+        elif total is None and prefix in total_prefixes and event in ('number', 'string'):
+            try:
+                total = int(value)
+            except (TypeError, ValueError):
+                pass
+
+    columns = dict(string_buffers)
+    for k, buffer in attend_buffers.items():
+        columns[k] = np.frombuffer(buffer, dtype=np.int16) if len(buffer) else np.zeros(0, dtype=np.int16)
+    return total, pd.DataFrame(columns)
+
+
+def _fetch_member_page(token, year, week, page):
+    """
+    抓取單一頁的成員資料。
+    :return: (JSON 摘要 (串流模式下不含 members), 總筆數或 None, 該頁成員 DataFrame)
+    """
+    params = _member_params(year, week, page)
+    token = _current_token(token)
+    if STREAM_PARSE:
+        response = _authorized_get(DATA_URL, token, params, stream=True)
+        try:
+            response.raw.decode_content = True  # 處理 gzip 等傳輸編碼
+            total, frame = _stream_members(response.raw)
+        finally:
+            response.close()
+        return {'data': {'total': total}}, total, frame
+
+    json_data = _authorized_get(DATA_URL, token, params).json()
+    data = json_data.get('data', {}) or {}
+    return json_data, _extract_total_count(data), pd.DataFrame(data.get('members', []))
+
+
+def fetch_all_members(token, year, week):
+    """
+    抓取某一週的所有成員 (自動分頁)。
+    先抓第 1 頁取得總筆數，其餘頁面以執行緒池併發抓取後依頁序合併。
+    若 API 未回傳總筆數，則逐頁抓取直到某頁不足 PAGE_SIZE 筆、與前一頁重複 (API 忽略 page 參數)
+    或達到 FETCH_MAX_PAGES 頁為止。
+    :return: (第 1 頁的 JSON, 所有頁面的成員 DataFrame)
+    """
+    first_json, total, first_frame = _fetch_member_page(token, year, week, 1)
+    page_frames = [first_frame]
+
+    if total is not None:
+        total_pages = max(1, math.ceil(total / PAGE_SIZE))
+        if total_pages > 1:
+            print(f"共 {total} 筆成員，分 {total_pages} 頁抓取 (併發上限 {FETCH_MAX_WORKERS})...")
+
+            def fetch_page_frame(page):
+                return _fetch_member_page(token, year, week, page)[2]
+
+            with ThreadPoolExecutor(max_workers=FETCH_MAX_WORKERS) as executor:
+                # executor.map 會依頁序回傳結果
+                page_frames.extend(executor.map(fetch_page_frame, range(2, total_pages + 1)))
+    else:
+        page = 1
+        while len(page_frames[-1]) >= PAGE_SIZE:
+            if page >= FETCH_MAX_PAGES:
+                print(f"⚠️ 已抓取 {page} 頁仍未結束，停止分頁 (上限 FETCH_MAX_PAGES={FETCH_MAX_PAGES})")
+                break
+            page += 1
+            frame = _fetch_member_page(token, year, week, page)[2]
+            if frame.equals(page_frames[-1]):
+                print(f"⚠️ 第 {page} 頁與前一頁內容相同 (API 可能忽略分頁參數)，停止分頁")
+                break
+            page_frames.append(frame)
+
+    page_frames = [frame for frame in page_frames if not frame.empty]
+    if not page_frames:
+        return first_json, pd.DataFrame()
+    if len(page_frames) == 1:
+        return first_json, page_frames[0]
+    return first_json, pd.concat(page_frames, ignore_index=True)
+
+
+def fetch_weekly_data(token, year, week, week_start_date_str):
+    """
+    使用 Token 抓取數據 (含所有分頁)，格式化並存檔為 Excel。
+    若本週資料的內容雜湊與倉儲中已存的相同，則略過所有寫檔。
+    :return: (json_data, df_formatted, changed)
+    """
     
     print(f"嘗試抓取 {year} 年 第 {week} 週的數據...")
+    json_data = None
+    df_raw = pd.DataFrame()
     try:
-        response = requests.get(DATA_URL, headers=headers, params=params)
-        response.raise_for_status()
-        
-        json_data = response.json()
-        members_list = json_data.get('data', {}).get('members', [])
+        json_data, df_raw = fetch_all_members(token, year, week)
         
-        if members_list:
-            df_raw = pd.DataFrame(members_list)
+        if not df_raw.empty:
+            print(f"已取得 {len(df_raw)} 筆成員資料。")
             
             # 💡 格式化數據
             df_formatted = format_dataframe_for_output(df_raw)
-            
-            # --- 存檔操作: 存為格式化 Excel (reports_excel) ---
+
             filename_excel = f"attend_{week_start_date_str}.xlsx"
-            os.makedirs(DATA_FOLDER_EXCEL, exist_ok=True)
             filepath_excel = os.path.join(DATA_FOLDER_EXCEL, filename_excel)
+
+            # --- 變動偵測: 與倉儲中已存的內容雜湊比對 ---
+            week_content_hash = attendance_store.content_hash(df_formatted)
+            stored_hash = attendance_store.week_hash(attendance_store.MEMBERS_DATASET, week_start_date_str)
+            if stored_hash == week_content_hash and os.path.exists(filepath_excel):
+                print(f"⏭️ {week_start_date_str} 的資料未變動，略過寫檔。")
+                return json_data, df_formatted, False
+
+            # --- 寫入出席資料倉儲 (讀取端的唯一資料來源) ---
+            store_path = attendance_store.write_week(
+                attendance_store.MEMBERS_DATASET, week_start_date_str, df_formatted,
+                week_content_hash=week_content_hash,
+            )
+            if store_path:
+                print(f"✅ 個人明細已寫入倉儲: {store_path}")
+
+            # --- 寫入出席事實表 (SQLite)，供個人/小區查詢使用 ---
+            try:
+                row_count = attendance_db.upsert_week(week_start_date_str, df_formatted, week_content_hash)
+                print(f"✅ 出席事實表已更新: {row_count} 筆")
+            except Exception as e:
+                print(f"❌ 寫入出席事實表失敗: {e}")
+
+            # --- 存檔操作: 匯出格式化 Excel (reports_excel) ---
+            os.makedirs(DATA_FOLDER_EXCEL, exist_ok=True)
             df_formatted.to_excel(filepath_excel, index=False)
             print(f"✅ 格式化報表已存檔 (Excel): {filepath_excel}")
 
             # 返回格式化後的 DataFrame，供後續分析使用 (這次不需額外的 '大區_API' 欄位)
-            return json_data, df_formatted
+            return json_data, df_formatted, True
         
-        return json_data, pd.DataFrame() # 數據為空時
+        return json_data, pd.DataFrame(), False # 數據為空時
 
     except requests.exceptions.RequestException as e:
         print(f"數據抓取失敗：{e}")
-        return None, pd.DataFrame()
+        return None, pd.DataFrame(), False
     except Exception as e:
         print(f"存檔過程中發生錯誤: {e}")
         # 為了分析，盡量返回數據
         try:
-            df_raw = pd.DataFrame(json_data.get('data', {}).get('members', []))
-            return json_data, format_dataframe_for_output(df_raw)
+            return json_data, format_dataframe_for_output(df_raw), True
         except:
-            return json_data, pd.DataFrame()
+            return json_data, pd.DataFrame(), False
 
 
-def analyze_church_data(df_formatted, week_start_date):
+def _export_summary_excel(summary_df_output, week_start_date):
+    """匯出總結 Excel (選用，讀取端不再依賴此檔案)。"""
+    try:
+        filename_summary = f"summary_{week_start_date}.xlsx"
+        os.makedirs(DATA_FOLDER_SUMMARY_EXCEL, exist_ok=True)
+        filepath_summary = os.path.join(DATA_FOLDER_SUMMARY_EXCEL, filename_summary)
+
+        summary_df_output.to_excel(filepath_summary, index=False)
+        print(f"✅ 人數統計報表已存檔 (Excel): {filepath_summary}")
+        
+    except Exception as e:
+        print(f"❌ 儲存統計總結報表失敗: {e}")
+
+
+def analyze_church_data(df_formatted, week_start_date, save=True):
     """
     根據 '區別' (小區名稱) 生成統計報表。
+    :param save: 是否匯出總結 Excel (資料未變動時可略過；EXPORT_SUMMARY_EXCEL 關閉時不匯出)。
     """
     if df_formatted.empty:
         return "⚠️ 本週尚未有數據或抓取失敗。", pd.DataFrame() 
@@ -168,24 +485,16 @@ def analyze_church_data(df_formatted, week_start_date):
     grouping_col = '區別' 
     attend_cols = [v for k, v in ATTEND_MAP.items() if k.startswith('attend')]
     
-    summary_df = df_formatted.groupby(grouping_col)[attend_cols].sum()
+    summary_df = df_formatted.groupby(grouping_col, observed=True)[attend_cols].sum()
     total_row = summary_df.sum().to_frame().T
     total_row.index = ['總計']
     summary_df = pd.concat([summary_df, total_row])
 
-    try:
-        filename_summary = f"summary_{week_start_date}.xlsx"
-        os.makedirs(DATA_FOLDER_SUMMARY_EXCEL, exist_ok=True)
-        filepath_summary = os.path.join(DATA_FOLDER_SUMMARY_EXCEL, filename_summary)
-        
-        # 將 '區別' 變成一個欄位，而不是 Index (方便其他腳本讀取)
-        summary_df_output = summary_df.reset_index().rename(columns={'index': grouping_col})
+    # 將 '區別' 變成一個欄位，而不是 Index (方便其他腳本讀取)
+    summary_df_output = summary_df.reset_index().rename(columns={'index': grouping_col})
 
-        summary_df_output.to_excel(filepath_summary, index=False)
-        print(f"✅ 人數統計報表已存檔 (Excel): {filepath_summary}")
-        
-    except Exception as e:
-        print(f"❌ 儲存統計總結報表失敗: {e}")
+    if save and EXPORT_SUMMARY_EXCEL:
+        _export_summary_excel(summary_df_output, week_start_date)
 
     report = []
     report.append(f"📊 **本週教會人數統計報表 (按小區 - {grouping_col} 分組)**")
@@ -196,6 +505,15 @@ def analyze_church_data(df_formatted, week_start_date):
     return "\n".join(report), df_formatted # 回傳 df 供 RAG 函式使用
 
 # --- 3. 主執行邏輯 ---
+def process_week(token, year, week, week_start_date):
+    """抓取單一週的數據並產出所有當週檔案 (倉儲、出席事實表、個人 Excel、選用的總結 Excel)。"""
+    json_data, df_formatted, changed = fetch_weekly_data(token, year, week, week_start_date)
+    if json_data is None:
+        return None
+    report_text, _ = analyze_church_data(df_formatted, week_start_date, save=changed)
+    return report_text
+
+
 def main(target_date=None):
     token = get_auth_token()
     if not token:
@@ -205,14 +523,11 @@ def main(target_date=None):
     report = f"自動抓取報告：{week_start_date}（{year} 年 第 {week} 週）"
     print(report)
 
-    # 抓取數據並自動存檔 Excel
-    json_data, df_formatted = fetch_weekly_data(token, year, week, week_start_date)
+    # 抓取數據、自動存檔 Excel 並生成統計報告
+    report_text = process_week(token, year, week, week_start_date)
 
-    if json_data is None:
+    if report_text is None:
         return
-
-    # 進行 RAG 分析並生成報告
-    report_text, df_summary = analyze_church_data(df_formatted, week_start_date)
     
     # 輸出最終報告（先輸出統計表格）
     print("\n--- 💻 自動生成報告 (統計表格) ---")
@@ -220,6 +535,53 @@ def main(target_date=None):
         
     print("--- 報告結束 ---")
     return report
-    
+
+
+def backfill(start_date, end_date, max_workers=BACKFILL_MAX_WORKERS):
+    """
+    回補一段日期區間內每一週的歷史數據。
+    只登入一次並共用 Token，各週以執行緒池併發抓取 (上限 max_workers 週)。
+    :return: 回補結果摘要文字
+    """
+    token = get_auth_token()
+    if not token:
+        return "登入失敗"
+
+    weeks = iter_church_weeks(start_date, end_date)
+    print(f"開始回補 {len(weeks)} 週數據 (併發上限 {max_workers})...")
+
+    succeeded, failed = [], []
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {
+            executor.submit(process_week, token, year, week, week_start_date): week_start_date
+            for year, week, week_start_date in weeks
+        }
+        for future in as_completed(futures):
+            week_start_date = futures[future]
+            try:
+                ok = future.result() is not None
+            except Exception as e:
+                print(f"❌ {week_start_date} 回補失敗: {e}")
+                ok = False
+            (succeeded if ok else failed).append(week_start_date)
+
+    report = f"回補完成：成功 {len(succeeded)} 週，失敗 {len(failed)} 週"
+    if failed:
+        report += f"（失敗週次：{', '.join(sorted(failed))}）"
+    print(report)
+    return report
+
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="抓取召會人數數據")
+    subparsers = parser.add_subparsers(dest="command")
+    backfill_parser = subparsers.add_parser("backfill", help="回補一段日期區間的歷史數據")
+    backfill_parser.add_argument("start_date", help="起始日期 YYYY-MM-DD")
+    backfill_parser.add_argument("end_date", help="結束日期 YYYY-MM-DD")
+    backfill_parser.add_argument("--workers", type=int, default=BACKFILL_MAX_WORKERS, help="同時處理的週數上限")
+    args = parser.parse_args()
+
+    if args.command == "backfill":
+        backfill(args.start_date, args.end_date, max_workers=args.workers)
+    else:
+        main()
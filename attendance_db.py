@@ -0,0 +1,175 @@
+"""
+出席事實表 (SQLite, WAL 模式)。
+
+member_week 表以「聖徒 × 週次 × 項目」為一列，保存完整的歷史，供「查 <姓名>」指令使用：
+    - 主鍵 (member, week, activity) 同時作為 (member, week) 索引，
+      例如「某位聖徒最近 12 週」(member_history)。
+    - 歷史上所有聖徒的姓名與最近所屬區別 (member_directory)，供姓名索引使用。
+
+小區的人數與缺席名單等問題由 local_query_engine 以記憶體中的近五週明細回答，不查詢此表。
+
+`app.fetch_weekly_data` 每週寫入一次；既有歷史可用 sync_from_store() 從出席資料倉儲補入。
+"""
+import os
+import sqlite3
+import threading
+from typing import List, Optional, Tuple
+
+import pandas as pd
+
+import attendance_store
+
+DB_PATH = os.environ.get("ATTENDANCE_DB_PATH", os.path.join(attendance_store.STORE_DIR, "attendance.db"))
+
+ACTIVITY_COLUMNS = ["主日", "禱告", "家出訪", "家受訪", "小排", "晨興", "福出訪"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS member_week (
+    member   TEXT NOT NULL,     -- 姓名
+    district TEXT,              -- 區別 (小區)
+    sex      TEXT,              -- 性別
+    week     TEXT NOT NULL,     -- 週末日 YYYY-MM-DD
+    activity TEXT NOT NULL,     -- 主日 / 禱告 / 小排 / 晨興 ...
+    attended INTEGER NOT NULL,  -- 1=出席, 0=缺席
+    PRIMARY KEY (member, week, activity)
+) WITHOUT ROWID;
+DROP INDEX IF EXISTS idx_member_week_district;
+CREATE TABLE IF NOT EXISTS loaded_weeks (
+    week         TEXT PRIMARY KEY,
+    content_hash TEXT
+);
+"""
+
+_local = threading.local()
+_write_lock = threading.Lock()
+
+
+def get_connection() -> sqlite3.Connection:
+    """每個執行緒各自持有一條連線 (sqlite3 連線不可跨執行緒共用)。"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        os.makedirs(os.path.dirname(DB_PATH) or ".", exist_ok=True)
+        conn = sqlite3.connect(DB_PATH, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        _local.conn = conn
+    return conn
+
+
+def upsert_week(week_date_str: str, df_formatted: pd.DataFrame, content_hash: Optional[str] = None) -> int:
+    """
+    寫入某一週的點名明細 (EXCEL_COLUMNS_ORDER 格式)。
+    以單一交易取代該週既有資料，重複寫入同一週的結果相同。
+    :return: 寫入的列數
+    """
+    if df_formatted is None or df_formatted.empty or "姓名" not in df_formatted.columns:
+        return 0
+
+    activity_cols = [c for c in ACTIVITY_COLUMNS if c in df_formatted.columns]
+    base = df_formatted[["姓名"] + [c for c in ("區別", "性別") if c in df_formatted.columns]]
+    base = base.reindex(columns=["姓名", "區別", "性別"])
+    long_df = pd.concat([base] * len(activity_cols), ignore_index=True)
+    long_df["activity"] = [col for col in activity_cols for _ in range(len(df_formatted))]
+    long_df["attended"] = pd.concat(
+        [pd.to_numeric(df_formatted[col], errors="coerce").fillna(0) for col in activity_cols],
+        ignore_index=True,
+    ).astype(int).clip(0, 1)
+    long_df = long_df.dropna(subset=["姓名"])
+
+    rows = [
+        (str(name), None if pd.isna(district) else str(district), None if pd.isna(sex) else str(sex),
+         week_date_str, activity, int(attended))
+        for name, district, sex, activity, attended in long_df.itertuples(index=False, name=None)
+    ]
+
+    conn = get_connection()
+    with _write_lock, conn:
+        conn.execute("DELETE FROM member_week WHERE week = ?", (week_date_str,))
+        # 同名聖徒在同一週出現多次時，只要任一筆有出席即視為出席
+        conn.executemany(
+            """
+            INSERT INTO member_week (member, district, sex, week, activity, attended)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (member, week, activity) DO UPDATE SET
+                attended = MAX(attended, excluded.attended)
+            """,
+            rows,
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO loaded_weeks (week, content_hash) VALUES (?, ?)",
+            (week_date_str, content_hash),
+        )
+    return len(rows)
+
+
+def sync_from_store() -> int:
+    """
+    將出席資料倉儲中尚未載入 (或內容已變動) 的週次補入資料庫。
+    :return: 補入的週數
+    """
+    conn = get_connection()
+    loaded = dict(conn.execute("SELECT week, content_hash FROM loaded_weeks").fetchall())
+
+    synced = 0
+    for week_date, path in attendance_store.list_partitions(attendance_store.MEMBERS_DATASET):
+        week_date_str = week_date.strftime("%Y-%m-%d")
+        store_hash = attendance_store.week_hash(attendance_store.MEMBERS_DATASET, week_date_str)
+        if week_date_str in loaded and (store_hash is None or loaded[week_date_str] == store_hash):
+            continue
+        try:
+            upsert_week(week_date_str, attendance_store.read_partition(path), store_hash)
+            synced += 1
+        except Exception as e:
+            print(f"⚠ 無法將 {week_date_str} 載入出席資料庫: {e}")
+
+    if synced:
+        print(f"📥 已將 {synced} 週資料載入出席資料庫")
+    return synced
+
+
+def recent_weeks(limit: int) -> List[str]:
+    """回傳資料庫中最近 N 個週次 (由新到舊)。"""
+    rows = get_connection().execute(
+        "SELECT week FROM loaded_weeks ORDER BY week DESC LIMIT ?", (limit,)
+    ).fetchall()
+    return [row[0] for row in rows]
+
+
+def member_history(member: str, weeks: int = 12) -> pd.DataFrame:
+    """
+    某位聖徒最近 N 週的出席紀錄。
+    :return: index 為週次、欄位為各項目的 DataFrame (1=出席, 0=缺席)
+    """
+    week_list = recent_weeks(weeks)
+    if not week_list:
+        return pd.DataFrame()
+
+    placeholders = ",".join("?" * len(week_list))
+    df = pd.read_sql_query(
+        f"""
+        SELECT week, district, activity, attended FROM member_week
+        WHERE member = ? AND week IN ({placeholders})
+        """,
+        get_connection(),
+        params=[member] + week_list,
+    )
+    if df.empty:
+        return df
+
+    timeline = df.pivot_table(index="week", columns="activity", values="attended", aggfunc="max")
+    timeline = timeline.reindex(columns=[c for c in ACTIVITY_COLUMNS if c in timeline.columns])
+    timeline.insert(0, "區別", df.groupby("week")["district"].last())
+    return timeline.sort_index()
+
+
+def member_directory() -> List[Tuple[str, Optional[str]]]:
+    """資料庫中所有聖徒的 (姓名, 最近一週所屬區別)，供姓名索引使用。"""
+    rows = get_connection().execute(
+        """
+        SELECT member, district, MAX(week) FROM member_week
+        GROUP BY member
+        ORDER BY member
+        """
+    ).fetchall()
+    return [(member, district) for member, district, _ in rows]
@@ -0,0 +1,119 @@
+"""
+出席洞察：在知識庫重建時預先計算各小區的跨週比較事實，
+讓 Gemini 直接引用，而不必自己從逐週明細推算。
+
+每個小區、每個項目 (主日/禱告/小排/晨興) 計算：
+    - 本週人數與較上週的增減
+    - 新缺席：上週有來、本週沒來
+    - 回來：上週沒來、本週有來
+    - 連續缺席：最近連續 STREAK_WEEKS 週以上都沒來
+"""
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+INSIGHT_ACTIVITIES = ["主日", "禱告", "小排", "晨興"]
+STREAK_WEEKS = 3
+MAX_LISTED_NAMES = 10
+TOTAL_KEY = "全體"
+
+
+def _name_list(names: np.ndarray) -> str:
+    listed = "、".join(names[:MAX_LISTED_NAMES])
+    if len(names) > MAX_LISTED_NAMES:
+        listed += f" 等 {len(names)} 人"
+    return listed
+
+
+def _delta_text(current: float, previous: Optional[float]) -> str:
+    if previous is None:
+        return f"{int(current)}人"
+    return f"{int(current)}人（較上週 {int(current - previous):+d}）"
+
+
+def compute_insights(df_summary: Optional[pd.DataFrame], df_personal: Optional[pd.DataFrame]) -> Dict[str, List[str]]:
+    """
+    :return: {區別: [事實文字, ...]}，另含 '全體' 的人數增減。
+    """
+    insights: Dict[str, List[str]] = {}
+
+    dates: List[str] = []
+    if df_personal is not None and not df_personal.empty:
+        dates = sorted(df_personal["日期"].astype(str).unique(), reverse=True)
+
+    # --- 1. 人數增減 (來自總結數據) ---
+    counts = None
+    if df_summary is not None and not df_summary.empty:
+        activity_cols = [c for c in INSIGHT_ACTIVITIES if c in df_summary.columns]
+        summary = df_summary.assign(週次=pd.to_datetime(df_summary["週末日"]).dt.strftime("%Y/%m/%d"),
+                                    區別=df_summary["區別"].astype(str))
+        counts = summary.groupby(["區別", "週次"])[activity_cols].sum()
+        totals = summary.groupby("週次")[activity_cols].sum()
+        counts = pd.concat([counts, pd.concat({TOTAL_KEY: totals})])
+        summary_dates = sorted(summary["週次"].unique(), reverse=True)
+        latest = summary_dates[0]
+        previous = summary_dates[1] if len(summary_dates) > 1 else None
+
+        for district in counts.index.get_level_values(0).unique():
+            district_counts = counts.loc[district]
+            if latest not in district_counts.index:
+                continue
+            parts = []
+            for activity in activity_cols:
+                prev_value = district_counts.at[previous, activity] if previous in district_counts.index else None
+                parts.append(f"{activity} {_delta_text(district_counts.at[latest, activity], prev_value)}")
+            insights.setdefault(district, []).append(f"{latest} 人數：" + "、".join(parts))
+
+    # --- 2. 個人層級的跨週事實 (來自個人明細) ---
+    if not dates:
+        return insights
+
+    activity_cols = [c for c in INSIGHT_ACTIVITIES if c in df_personal.columns]
+    wide = df_personal.assign(日期=df_personal["日期"].astype(str),
+                              區別=df_personal["區別"].astype(str),
+                              姓名=df_personal["姓名"].astype(str)).pivot_table(
+        index=["區別", "姓名"], columns="日期", values=activity_cols, aggfunc="max"
+    )
+    districts = wide.index.get_level_values(0).to_numpy()
+    names = wide.index.get_level_values(1).to_numpy()
+
+    for activity in activity_cols:
+        # 欄位由新到舊；NaN 表示該週不在名單中
+        values = wide[activity].reindex(columns=dates).to_numpy(dtype=float)
+        current = values[:, 0]
+        previous = values[:, 1] if len(dates) > 1 else np.full(len(values), np.nan)
+
+        newly_absent = (previous == 1) & (current == 0)
+        returning = (previous == 0) & (current == 1)
+        # 從最新一週往回數連續缺席的週數
+        absent_streak = np.cumprod(values == 0, axis=1).sum(axis=1)
+        long_absent = absent_streak >= STREAK_WEEKS
+
+        for district in np.unique(districts):
+            in_district = districts == district
+            facts = []
+            if newly_absent[in_district].any():
+                facts.append(f"新缺席 {int(newly_absent[in_district].sum())}人：{_name_list(names[in_district & newly_absent])}")
+            if returning[in_district].any():
+                facts.append(f"回來 {int(returning[in_district].sum())}人：{_name_list(names[in_district & returning])}")
+            if long_absent[in_district].any() and len(dates) >= STREAK_WEEKS:
+                facts.append(f"連續 {STREAK_WEEKS} 週以上缺席 {int(long_absent[in_district].sum())}人：{_name_list(names[in_district & long_absent])}")
+            if facts:
+                insights.setdefault(district, []).append(f"{activity}｜" + "｜".join(facts))
+
+    return insights
+
+
+def render_insights(insights: Dict[str, List[str]], districts: Optional[List[str]] = None) -> str:
+    """
+    將洞察轉成簡短的事實清單。
+    :param districts: 若提供則只輸出這些小區 (以及全體)。
+    """
+    lines = []
+    for district in sorted(insights, key=lambda d: (d != TOTAL_KEY, d)):
+        if districts and district != TOTAL_KEY and district not in districts:
+            continue
+        lines.append(f"[{district}]")
+        lines.extend(f"- {fact}" for fact in insights[district])
+    return "\n".join(lines)
@@ -0,0 +1,221 @@
+"""
+出席資料倉儲：以週為分割單位的 Parquet 欄式儲存。
+
+目錄結構：
+    attendance_store/members/week=YYYY-MM-DD.parquet   個人點名明細 (每週一份)
+    attendance_store/summary/week=YYYY-MM-DD.parquet   各區別彙總 (僅用於沒有個人明細的舊週次)
+
+`app.fetch_weekly_data` 每週寫入一次，讀取端 (圖表、RAG) 一律查詢此倉儲；
+reports_excel / reports_summary 內的 Excel 僅作為匯出檔案，
+以及倉儲尚未建立時的一次性匯入來源。
+
+每次寫入時會計算該週表格的內容雜湊並記錄於 attendance_store/manifest.json，
+上游可據此判斷重新抓取的週次是否真的有變動，略過多餘的下游工作。
+"""
+import os
+import re
+import glob
+import json
+import hashlib
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow.parquet as pq  # pandas 的 Parquet 引擎
+    PARQUET_AVAILABLE = True
+except ImportError:
+    print("⚠️ 未安裝 pyarrow，出席資料倉儲停用，將改為直接讀取 Excel。")
+    PARQUET_AVAILABLE = False
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+STORE_DIR = os.environ.get("ATTENDANCE_STORE_DIR", os.path.join(CURRENT_DIR, "attendance_store"))
+
+MEMBERS_DATASET = "members"
+SUMMARY_DATASET = "summary"
+
+WEEK_COLUMN = "週末日"
+_PARTITION_PATTERN = re.compile(r"^week=(\d{4}-\d{2}-\d{2})\.parquet$")
+
+# 個人明細的精簡型別：重複字串改為 category (同一字串只存一份)，出席旗標改為 uint8
+CATEGORY_COLUMNS = ["姓名", "性別", "區別", "日期"]
+ATTENDANCE_FLAG_COLUMNS = ["主日", "禱告", "家出訪", "家受訪", "小排", "晨興", "福出訪"]
+
+MANIFEST_FILENAME = "manifest.json"
+_manifest_lock = threading.Lock()
+
+
+def _dataset_dir(dataset: str) -> str:
+    return os.path.join(STORE_DIR, dataset)
+
+
+def partition_path(dataset: str, week_date_str: str) -> str:
+    """回傳某一週的分割檔路徑 (不論是否存在)。"""
+    return os.path.join(_dataset_dir(dataset), f"week={week_date_str}.parquet")
+
+
+def compact_member_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    將「個人明細」表轉成精簡型別 (不可用於總結表，總結表的人數會超過 uint8 範圍)。
+    - 姓名/性別/區別/日期 → category：多週資料合併後每個名字只存一份字串。
+    - 出席欄位 → uint8：加總時 pandas 會自動升為 uint64，不會溢位。
+    注意：以 category 欄位 groupby 時需加上 observed=True。
+    """
+    compact = df.copy()
+    for col in CATEGORY_COLUMNS:
+        if col in compact.columns and not isinstance(compact[col].dtype, pd.CategoricalDtype):
+            compact[col] = compact[col].astype("category")
+    for col in ATTENDANCE_FLAG_COLUMNS:
+        if col in compact.columns and compact[col].dtype != np.uint8:
+            compact[col] = pd.to_numeric(compact[col], errors="coerce").fillna(0).clip(0, 255).astype(np.uint8)
+    return compact
+
+
+def content_hash(df: pd.DataFrame) -> str:
+    """
+    計算表格內容的雜湊值 (與列順序、欄位順序無關)。
+    同一週重新抓取但資料未變動時，雜湊值會相同。
+    """
+    normalized = df.drop(columns=[WEEK_COLUMN], errors="ignore")
+    normalized = normalized[sorted(normalized.columns, key=str)]
+    if not normalized.empty:
+        normalized = normalized.sort_values(list(normalized.columns)).reset_index(drop=True)
+
+    digest = hashlib.sha256()
+    digest.update(json.dumps([str(c) for c in normalized.columns], ensure_ascii=False).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(normalized, index=False).values.tobytes())
+    return digest.hexdigest()
+
+
+def _manifest_path() -> str:
+    return os.path.join(STORE_DIR, MANIFEST_FILENAME)
+
+
+def _read_manifest() -> Dict[str, Dict[str, str]]:
+    path = _manifest_path()
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"⚠ 無法讀取倉儲雜湊清單 {path}: {e}")
+        return {}
+
+
+def _record_week_hash(dataset: str, week_date_str: str, week_hash: str) -> None:
+    with _manifest_lock:
+        manifest = _read_manifest()
+        manifest.setdefault(dataset, {})[week_date_str] = week_hash
+        os.makedirs(STORE_DIR, exist_ok=True)
+        tmp_path = f"{_manifest_path()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp_path, _manifest_path())
+
+
+def week_hash(dataset: str, week_date_str: str) -> Optional[str]:
+    """回傳某一週已儲存資料的內容雜湊；分割檔不存在時回傳 None。"""
+    if not has_week(dataset, week_date_str):
+        return None
+    with _manifest_lock:
+        return _read_manifest().get(dataset, {}).get(week_date_str)
+
+
+def data_version() -> Optional[str]:
+    """
+    整個倉儲的資料版本 (所有週次雜湊的雜湊)。
+    任何一週的內容變動都會改變版本；倉儲停用時回傳 None (視為永遠可能變動)。
+    """
+    if not PARQUET_AVAILABLE:
+        return None
+    with _manifest_lock:
+        manifest = _read_manifest()
+    return hashlib.sha256(json.dumps(manifest, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def write_week(dataset: str, week_date_str: str, df: pd.DataFrame,
+               week_content_hash: Optional[str] = None) -> Optional[str]:
+    """
+    寫入 (或覆寫) 某一週的分割檔，並記錄其內容雜湊。
+    先寫入暫存檔再 os.replace，避免讀取端讀到寫到一半的檔案。
+    :param week_content_hash: 呼叫端已算好的 content_hash(df)，可省去重複計算。
+    """
+    if not PARQUET_AVAILABLE:
+        return None
+
+    os.makedirs(_dataset_dir(dataset), exist_ok=True)
+    path = partition_path(dataset, week_date_str)
+    tmp_path = f"{path}.tmp"
+
+    # 週次由檔名決定，不重複存入資料本身
+    table = df.drop(columns=[WEEK_COLUMN], errors="ignore").reset_index(drop=True)
+    table.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+    _record_week_hash(dataset, week_date_str, week_content_hash or content_hash(table))
+    return path
+
+
+def list_partitions(dataset: str) -> List[Tuple[datetime, str]]:
+    """列出資料集中所有週次分割檔，依日期由舊到新排序。"""
+    partitions = []
+    for path in glob.glob(os.path.join(_dataset_dir(dataset), "week=*.parquet")):
+        match = _PARTITION_PATTERN.match(os.path.basename(path))
+        if not match:
+            continue
+        partitions.append((datetime.strptime(match.group(1), "%Y-%m-%d"), path))
+    partitions.sort(key=lambda item: item[0])
+    return partitions
+
+
+def has_week(dataset: str, week_date_str: str) -> bool:
+    return os.path.exists(partition_path(dataset, week_date_str))
+
+
+def read_partition(path: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """讀取單一分割檔；指定 columns 時只解碼其中實際存在的欄位。"""
+    if columns is not None:
+        schema_names = set(pq.read_schema(path).names)
+        columns = [c for c in columns if c in schema_names]
+    return pd.read_parquet(path, columns=columns)
+
+
+def import_excel_history(dataset: str, pattern: str,
+                         loader: Callable[[str], Optional[pd.DataFrame]],
+                         date_parser: Callable[[str], Optional[datetime]],
+                         covered_by: Optional[str] = None) -> int:
+    """
+    將倉儲中尚未存在的週次從 Excel 匯入 (僅在首次部署或手動補檔時會真正讀檔)。
+    :param pattern: Excel 檔案的 glob 樣式。
+    :param loader: 讀取單一 Excel 並回傳表格的函式。
+    :param date_parser: 從檔名解析週末日的函式。
+    :param covered_by: 另一個資料集；該資料集已有的週次不必匯入 (例如已有個人明細的週次不需要總結表)。
+    :return: 匯入的週數。
+    """
+    if not PARQUET_AVAILABLE:
+        return 0
+
+    imported = 0
+    for path in sorted(glob.glob(pattern)):
+        week_date = date_parser(path)
+        if week_date is None:
+            continue
+        week_date_str = week_date.strftime("%Y-%m-%d")
+        if has_week(dataset, week_date_str):
+            continue
+        if covered_by is not None and has_week(covered_by, week_date_str):
+            continue
+
+        df = loader(path)
+        if df is None or df.empty:
+            continue
+        write_week(dataset, week_date_str, df)
+        imported += 1
+
+    if imported:
+        print(f"📥 已從 Excel 匯入 {imported} 週資料至倉儲 ({dataset})")
+    return imported
@@ -5,6 +5,8 @@ import gc
 import csv
 import json
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask, request, abort, send_from_directory
 from linebot import LineBotApi, WebhookHandler
 from linebot.exceptions import InvalidSignatureError
@@ -17,8 +19,8 @@ from oauth2client.service_account import ServiceAccountCredentials
 
 # 導入您的腳本
 from charts_generator import (
-    aggregate_reports, generate_region_charts, 
-    generate_rag_response, update_global_rag_context, REGION_MAPPING
+    aggregate_reports, build_all_region_timeseries, generate_region_charts, render_charts_batch,
+    generate_rag_response, update_global_rag_context, answer_locally, lookup_member, REGION_MAPPING
 )
 import app as church_api  # 導入您的 app.py (自動抓取程式)
 
@@ -48,6 +50,13 @@ SCHEDULE_DAY_OF_WEEK = os.environ.get("SCHEDULE_DAY_OF_WEEK", "mon")
 SCHEDULE_HOUR = int(os.environ.get("SCHEDULE_HOUR", 10))
 SCHEDULE_MINUTE = int(os.environ.get("SCHEDULE_MINUTE", 0))
 
+# RAG 問答改由背景執行緒處理，webhook 先立即回覆，完成後再以 push_message 送出答案
+RAG_MAX_INFLIGHT = int(os.environ.get("RAG_MAX_INFLIGHT", 2))  # 同時進行中的生成上限
+RAG_ANSWER_TIMEOUT_SECONDS = int(os.environ.get("RAG_ANSWER_TIMEOUT_SECONDS", 90))
+RAG_ACK_MESSAGE = os.environ.get("RAG_ACK_MESSAGE", "🤖 收到！分析中，完成後會另外傳送結果。")  # 設為空字串則不回覆
+rag_executor = ThreadPoolExecutor(max_workers=RAG_MAX_INFLIGHT, thread_name_prefix="rag")
+rag_slots = threading.BoundedSemaphore(RAG_MAX_INFLIGHT)
+
 def get_sheet_conn():
     """建立 Google Sheets 連線"""
     try:
@@ -142,18 +151,22 @@ def log_user_info(event):
 def auto_update_and_push():
     try:
         church_api.main() # 更新數據
-        update_global_rag_context(REPORTS_DIR_SUMMARY, REPORTS_DIR_EXCEL)
         group_config = get_group_config_from_sheet()
+        update_global_rag_context(REPORTS_DIR_SUMMARY, REPORTS_DIR_EXCEL, group_regions=group_config)
         if not group_config:
             print("⚠️ 無發送設定，跳過推送。")
             return
-        df_reports = aggregate_reports(REPORTS_DIR_SUMMARY)
+        df_reports = aggregate_reports(REPORTS_DIR_SUMMARY, REPORTS_DIR_EXCEL)
         base_url = os.environ.get("RENDER_EXTERNAL_URL", "").rstrip('/')
 
+        # 所有群組需要的區域一次繪製 (內容未變動的圖表直接沿用既有圖檔)；
+        # 在排程執行緒內依序繪製，不在 web 行程中另開子行程
+        all_regions = [region for regions in group_config.values() for region in regions]
+        render_charts_batch(df_reports, all_regions, CHARTS_OUTPUT_DIR, max_workers=1)
+
         for group_id, regions in group_config.items():
             push_msgs = [TextSendMessage(text="🔔 每週一自動數據更新完成！")]
             for region in regions:
-                generate_region_charts(df_reports, region, CHARTS_OUTPUT_DIR)
                 safe_filename = urllib.parse.quote(f"{region}_attendance.png")
                 img_url = f"{base_url}/charts/{safe_filename}"
                 push_msgs.append(ImageSendMessage(original_content_url=img_url, preview_image_url=img_url))
@@ -171,6 +184,60 @@ scheduler.add_job(
 )
 scheduler.start()
 
+def get_push_target(source) -> str:
+    """push_message 的收件對象：群組、聊天室或個人。"""
+    if source.type == 'group':
+        return source.group_id
+    if source.type == 'room':
+        return source.room_id
+    return source.user_id
+
+def submit_rag_query(target_id, user_query, group_id=None):
+    """
+    將 RAG 問題交給背景執行緒，完成後以 push_message 傳送答案。
+    超過 RAG_ANSWER_TIMEOUT_SECONDS 仍未完成時先推送逾時通知，之後的結果直接丟棄。
+    :param group_id: 群組 ID，有設定區域的群組只使用該區域的知識庫分區。
+    :return: 進行中的生成已達上限時回傳 False (不排入佇列)。
+    """
+    if not rag_slots.acquire(blocking=False):
+        return False
+
+    delivered = threading.Event()
+    deliver_lock = threading.Lock()
+
+    def deliver(text):
+        with deliver_lock:
+            if delivered.is_set():
+                return
+            delivered.set()
+        try:
+            line_bot_api.push_message(target_id, TextSendMessage(text=text))
+        except Exception as e:
+            print(f"❌ LINE API 推送失敗: {e}")
+
+    timer = threading.Timer(RAG_ANSWER_TIMEOUT_SECONDS, deliver,
+                            args=("⌛ 分析時間過長，請稍後再試或縮小問題範圍。",))
+    timer.daemon = True
+
+    def run():
+        try:
+            res = generate_rag_response(REPORTS_DIR_SUMMARY, REPORTS_DIR_EXCEL, user_query, group_id)
+        except Exception as e:
+            res = f"❌ 分析失敗: {e}"
+        finally:
+            timer.cancel()
+            rag_slots.release()
+        deliver(res)
+
+    timer.start()
+    try:
+        rag_executor.submit(run)
+    except Exception:
+        timer.cancel()
+        rag_slots.release()
+        raise
+    return True
+
 @app.route('/charts/<filename>')
 def serve_charts(filename):
     # 這讓 LINE 可以透過 https://您的網址/static/charts/xxx.png 抓到圖
@@ -236,7 +303,8 @@ def handle_message(event):
             display_text = f"（日期：{target_date}）" if target_date else ""
             # 呼叫 app.py 的 main 並帶入日期
             church_api.main(target_date=target_date)
-            update_global_rag_context(REPORTS_DIR_SUMMARY, REPORTS_DIR_EXCEL)
+            update_global_rag_context(REPORTS_DIR_SUMMARY, REPORTS_DIR_EXCEL,
+                                      group_regions=get_group_config_from_sheet())
             reply_msgs.append(TextSendMessage(text=f"✅ 數據更新完成！{display_text}"))
         except Exception as e:
             reply_msgs.append(TextSendMessage(text=f"❌ 更新失敗: {e}"))
@@ -246,7 +314,7 @@ def handle_message(event):
         md_report = church_api.main()
         logger.info(md_report)
         logger.info([f for f in os.listdir(REPORTS_DIR_SUMMARY) if os.path.isfile(os.path.join(REPORTS_DIR_SUMMARY, f))])
-        df_reports = aggregate_reports(REPORTS_DIR_SUMMARY)
+        df_reports = aggregate_reports(REPORTS_DIR_SUMMARY, REPORTS_DIR_EXCEL)
         logger.info(df_reports.head())
         logger.info([f for f in os.listdir(REPORTS_DIR_SUMMARY) if os.path.isfile(os.path.join(REPORTS_DIR_SUMMARY, f))])
         generate_region_charts(df_reports, "高中大區", CHARTS_OUTPUT_DIR)
@@ -260,13 +328,16 @@ def handle_message(event):
     # 3. 生成報表
     elif user_query in ["生成報表", "報表"]:
         try:
-            df_reports = aggregate_reports(REPORTS_DIR_SUMMARY)
+            df_reports = aggregate_reports(REPORTS_DIR_SUMMARY, REPORTS_DIR_EXCEL)
             
             # 先加入提示文字
             reply_msgs.append(TextSendMessage(text="📊 報表產製中，請點擊圖片查看細節："))
+            # webhook 執行緒內直接繪製 (不另開子行程)，各區共用同一份時間序列
+            region_timeseries = build_all_region_timeseries(df_reports)
+            for region_name in REGION_MAPPING.keys():
+                generate_region_charts(df_reports, region_name, CHARTS_OUTPUT_DIR, region_timeseries)
             
             for region_name in REGION_MAPPING.keys():
-                generate_region_charts(df_reports, region_name, CHARTS_OUTPUT_DIR)
                 filename = f"{region_name}_attendance.png"
                 
                 # 再次確保路徑正確
@@ -280,11 +351,23 @@ def handle_message(event):
         except Exception as e:
             reply_msgs.append(TextSendMessage(text=f"❌ 產圖失敗: {e}"))
 
-    # 4. Gemini 查詢
+    # 4. 查詢個人出席紀錄：「81人數助理 查 <姓名>」，由姓名索引直接回答
+    elif re.match(r"^查\s+\S", user_query):
+        try:
+            reply_msgs.append(TextSendMessage(text=lookup_member(user_query[1:].strip())))
+        except Exception as e:
+            reply_msgs.append(TextSendMessage(text=f"❌ 查詢失敗: {e}"))
+
+    # 5. 數據查詢：常見問題由本地引擎直接回答，開放式問題才交給 Gemini (背景處理，完成後推送)
     else:
         try:
-            res = generate_rag_response(REPORTS_DIR_SUMMARY, REPORTS_DIR_EXCEL, user_query)
-            reply_msgs.append(TextSendMessage(text=res))
+            res = answer_locally(user_query)
+            if res is not None:
+                reply_msgs.append(TextSendMessage(text=res))
+            elif not submit_rag_query(get_push_target(event.source), user_query, group_id):
+                reply_msgs.append(TextSendMessage(text="⏳ 目前分析中的問題較多，請稍後再試。"))
+            elif RAG_ACK_MESSAGE:
+                reply_msgs.append(TextSendMessage(text=RAG_ACK_MESSAGE))
         except Exception as e:
             reply_msgs.append(TextSendMessage(text=f"❌ 分析失敗: {e}"))
 
@@ -1,47 +1,77 @@
 import os
 import re
 import glob
+import json
 import gc
-from typing import List, Optional
-
+import hashlib
+import threading
+import multiprocessing
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
 import pandas as pd
 from datetime import datetime
 import matplotlib
 matplotlib.use('Agg') 
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import matplotlib.dates as mdates
 import matplotlib.font_manager as fm
 
-import google.generativeai as genai
+import attendance_store
+import attendance_db
+import rag_retrieval
+import local_query_engine
+import attendance_insights
+import member_index
+import llm_backend
+import context_budget
 
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_REPORTS_DIR_EXCEL = os.path.join(CURRENT_DIR, "reports_excel")
 FONT_PATH = os.path.join(CURRENT_DIR, 'fonts', 'NotoSansTC-Regular.ttf')
-if os.path.exists(FONT_PATH):
-    # 強制加入字體到 Matplotlib 的字體管理器
-    fm.fontManager.addfont(FONT_PATH)
-    # 獲取該字體的正式名稱
-    custom_font_name = fm.FontProperties(fname=FONT_PATH).get_name()
-    # 設定為全域預設字體
-    plt.rcParams['font.family'] = custom_font_name
-    # 修正負號顯示問題
-    plt.rcParams['axes.unicode_minus'] = False
-    print(f"✅ 已成功載入字體: {custom_font_name}")
-else:
-    print(f"❌ 找不到字體檔: {FONT_PATH}")
-    # Mac 備案：如果本地沒放字體，嘗試用 Mac 內建字體預覽 (但部署到 Render 會失效)
-    plt.rcParams['font.family'] = 'Arial Unicode MS'
-
-GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
-try:
-    generation_config = {
-    "temperature": 0,  # 設為 0 確保回答一致性
-}
-    genai.configure(api_key=GEMINI_API_KEY)
-    model = genai.GenerativeModel('gemini-2.5-flash', generation_config=generation_config)
-except Exception as e:
-    # 如果 API key 未設定或連線失敗，則 model 為 None
-    print(f"Gemini 配置失敗，RAG 功能將無法使用: {e}")
-    model = None
+_FONT_REGISTERED = False
+
+
+def register_chart_font() -> None:
+    """
+    註冊中文字體並設為 Matplotlib 預設字體。
+    每個行程只需執行一次 (批次繪圖的子行程由 initializer 呼叫，已註冊時直接略過)。
+    """
+    global _FONT_REGISTERED
+    if _FONT_REGISTERED:
+        return
+    if os.path.exists(FONT_PATH):
+        # 強制加入字體到 Matplotlib 的字體管理器
+        fm.fontManager.addfont(FONT_PATH)
+        # 獲取該字體的正式名稱
+        custom_font_name = fm.FontProperties(fname=FONT_PATH).get_name()
+        # 設定為全域預設字體
+        matplotlib.rcParams['font.family'] = custom_font_name
+        # 修正負號顯示問題
+        matplotlib.rcParams['axes.unicode_minus'] = False
+        print(f"✅ 已成功載入字體: {custom_font_name}")
+    else:
+        print(f"❌ 找不到字體檔: {FONT_PATH}")
+        # Mac 備案：如果本地沒放字體，嘗試用 Mac 內建字體預覽 (但部署到 Render 會失效)
+        matplotlib.rcParams['font.family'] = 'Arial Unicode MS'
+    _FONT_REGISTERED = True
+
+
+register_chart_font()
+
+# RAG 回答使用的 LLM 後端 (預設為 Gemini；LLM_BACKEND=fake 時使用本地替身)
+LLM = llm_backend.create_backend()
+
+
+def set_llm_backend(backend: Optional[llm_backend.LLMBackend]) -> None:
+    """替換 LLM 後端 (例如離線量測時改用 llm_backend.FakeBackend)，並清除舊後端的回答快取。"""
+    global LLM
+    LLM = backend
+    clear_rag_response_cache()
 
 
 REGION_MAPPING = {
@@ -56,10 +86,11 @@ ATTENDANCE_COLS = ['主日', '禱告', '小排', '晨興']
 # RAG 核心函式
 # -----------------------------------------------------------
 
-def _load_recent_summary_data(reports_dir_summary: str, weeks: int = 5) -> Optional[pd.DataFrame]:
-    """載入所有總結報表，並僅保留最近 N 週的數據。 (保持不變)"""
+def _load_recent_summary_data(reports_dir_summary: str, weeks: int = 5,
+                              reports_dir_excel: Optional[str] = None) -> Optional[pd.DataFrame]:
+    """載入所有總結數據，並僅保留最近 N 週的數據。"""
     try:
-        df_all = aggregate_reports(reports_dir_summary)
+        df_all = aggregate_reports(reports_dir_summary, reports_dir_excel)
         if df_all.empty: return None
         unique_dates = df_all["週末日"].dropna().unique()
         recent_dates = pd.Series(unique_dates).sort_values(ascending=False).head(weeks)
@@ -70,16 +101,43 @@ def _load_recent_summary_data(reports_dir_summary: str, weeks: int = 5) -> Optio
         return None
 
 
-def _load_filtered_raw_personal_data(reports_dir_excel: str, weeks: int = 5) -> Optional[pd.DataFrame]:
+def _load_attend_excel(file_path: str) -> Optional[pd.DataFrame]:
+    """讀取單一份個人點名 Excel (attend_YYYY-MM-DD.xlsx)，供倉儲匯入使用。"""
+    try:
+        df = pd.read_excel(file_path)
+    except Exception as e:
+        print(f"讀取 {file_path} 出錯: {e}")
+        return None
+    return _clean_table_headers(df)
+
+
+def _load_recent_personal_weeks(reports_dir_excel: str, weeks: int) -> List[tuple]:
     """
-    載入個人原始數據，並過濾五週內完全沒出現的聖徒。
+    取得最近 N 週的個人明細 [(日期, DataFrame), ...]。
+    優先查詢出席資料倉儲；倉儲停用時才退回逐一讀取 Excel。
     """
+    if attendance_store.PARQUET_AVAILABLE:
+        attendance_store.import_excel_history(
+            attendance_store.MEMBERS_DATASET,
+            os.path.join(reports_dir_excel, "attend_*.xls*"),
+            _load_attend_excel,
+            parse_week_end_date_from_filename,
+        )
+        partitions = attendance_store.list_partitions(attendance_store.MEMBERS_DATASET)
+        recent = []
+        for dt, path in partitions[-weeks:]:
+            try:
+                recent.append((dt, attendance_store.read_partition(path)))
+            except Exception as e:
+                print(f"讀取 {path} 出錯: {e}")
+        return recent
+
     pattern = os.path.join(reports_dir_excel, "attend_*.xls*")
     file_paths = glob.glob(pattern)
     
     if not file_paths:
         print(f"DEBUG: 在 {reports_dir_excel} 找不到 attend_*.xlsx 檔案")
-        return None
+        return []
         
     # 建立檔案清單並排序
     file_info = []
@@ -90,18 +148,29 @@ def _load_filtered_raw_personal_data(reports_dir_excel: str, weeks: int = 5) ->
     
     # 按日期由新到舊排序，取前 N 週
     file_info.sort(key=lambda x: x[0], reverse=True)
-    recent_files = file_info[:weeks]
+    recent = []
+    for dt, file_path in file_info[:weeks]:
+        df = _load_attend_excel(file_path)
+        if df is not None:
+            recent.append((dt, df))
+    return recent
+
+
+def _load_filtered_raw_personal_data(reports_dir_excel: str, weeks: int = 5) -> Optional[pd.DataFrame]:
+    """
+    載入個人原始數據，並過濾五週內完全沒出現的聖徒。
+    """
+    recent_weeks = _load_recent_personal_weeks(reports_dir_excel, weeks)
     
-    if not recent_files:
-        print("DEBUG: 找不到日期符合格式的 Excel 檔案")
+    if not recent_weeks:
+        print("DEBUG: 找不到日期符合格式的個人明細資料")
         return None
         
     all_data = []
     attendance_cols = ['主日', '禱告', '小排', '晨興']
     
-    for dt, file_path in recent_files:
+    for dt, df in recent_weeks:
         try:
-            df = pd.read_excel(file_path)
             df.columns = [str(c).strip() for c in df.columns]
             
             if '姓名' not in df.columns: continue
@@ -111,106 +180,493 @@ def _load_filtered_raw_personal_data(reports_dir_excel: str, weeks: int = 5) ->
             temp_df = df[available_cols].copy()
             
             for c in attendance_cols:
-                if c in temp_df.columns:
-                    temp_df[c] = pd.to_numeric(temp_df[c], errors='coerce').fillna(0).astype(int)
-                else:
+                if c not in temp_df.columns:
                     temp_df[c] = 0
             
             temp_df['日期'] = dt.strftime('%Y/%m/%d')
             all_data.append(temp_df)
         except Exception as e:
-            print(f"讀取 {file_path} 出錯: {e}")
+            print(f"處理 {dt.strftime('%Y-%m-%d')} 個人明細出錯: {e}")
             continue
 
     if not all_data: return None
 
-    df_total = pd.concat(all_data, ignore_index=True)
+    # 各週的 category 不同，合併後統一轉成精簡型別 (姓名/區別/日期 → category，出席 → uint8)
+    df_total = attendance_store.compact_member_frame(pd.concat(all_data, ignore_index=True))
 
     # 🚨 過濾：只保留五週內至少有一次出席的人
-    person_sum = df_total.groupby('姓名')[attendance_cols].transform('sum').sum(axis=1)
+    person_sum = df_total.groupby('姓名', observed=True)[attendance_cols].transform('sum').sum(axis=1)
     df_filtered = df_total[person_sum > 0].copy()
 
     # 回傳整理後的流水帳，方便 Gemini 比對
     return df_filtered[['日期', '區別', '姓名', '主日', '禱告', '小排', '晨興']].sort_values(['日期', '區別'], ascending=[False, True])
 
 
-def _generate_rag_context(reports_dir_summary: str, reports_dir_excel: str) -> str:
+def _load_rag_frames(reports_dir_summary: str, reports_dir_excel: str) -> Tuple[Optional[pd.DataFrame], Optional[pd.DataFrame]]:
+    """載入知識庫所需的近五週總結數據與個人明細。"""
+    df_summary = _load_recent_summary_data(reports_dir_summary, weeks=5, reports_dir_excel=reports_dir_excel)
+    df_personal = _load_filtered_raw_personal_data(reports_dir_excel, weeks=5)
+    return df_summary, df_personal
+
+
+def _encode_personal_compact(df_personal: pd.DataFrame) -> str:
     """
-    生成讓 Gemini 閱讀的知識庫內容。
+    將長格式的個人明細 (每人每週一列) 轉成寬格式的精簡文字：
+    依區別分段、每位聖徒一行，各項目以逐週的位元字串表示，欄位說明只出現一次。
+    例：「王小明|1101|1001|1111|0000」代表四個項目在各週的出席狀況。
     """
-    df_summary = _load_recent_summary_data(reports_dir_summary, weeks=5)
-    df_personal = _load_filtered_raw_personal_data(reports_dir_excel, weeks=5)
-    
-    context = ""
+    activity_cols = [c for c in ATTENDANCE_COLS if c in df_personal.columns]
+    dates = sorted(df_personal["日期"].astype(str).unique())
+
+    wide = df_personal.assign(日期=df_personal["日期"].astype(str)).pivot_table(
+        index=["區別", "姓名"], columns="日期", values=activity_cols, aggfunc="max", observed=True
+    )
+
+    bit_columns = []
+    for activity in activity_cols:
+        values = wide[activity].reindex(columns=dates).to_numpy(dtype=float)
+        chars = np.where(np.isnan(values), "-", np.where(values > 0, "1", "0"))
+        bit_columns.append(["".join(row) for row in chars])
+
+    lines = [
+        f"週次（由舊到新）：{', '.join(dates)}",
+        f"格式：姓名|{'|'.join(activity_cols)}；每個項目為逐週的出席位元（1=出席, 0=缺席, -=該週不在名單），順序同上方週次。",
+    ]
+    current_district = None
+    for row_index, (district, name) in enumerate(wide.index):
+        if district != current_district:
+            lines.append(f"[{district}]")
+            current_district = district
+        bits = "|".join(column[row_index] for column in bit_columns)
+        lines.append(f"{name}|{bits}")
+    return "\n".join(lines)
+
+
+# 知識庫各區段的名稱 (token 預算降級時用於記錄捨棄了哪些內容)
+SECTION_NOTE = "篩選說明"
+SECTION_SUMMARY = "總結報表數據"
+SECTION_PERSONAL = "個人原始點名明細"
+SECTION_INSIGHTS = "出席洞察"
+# 降級第二級：個人明細只保留最近幾週
+BUDGET_PERSONAL_WEEKS = 2
+
+
+def _render_rag_sections(df_summary: Optional[pd.DataFrame], df_personal: Optional[pd.DataFrame],
+                         retrieval_note: Optional[str] = None, insights_text: Optional[str] = None,
+                         personal_omitted: bool = False) -> Dict[str, str]:
+    """
+    依區段生成知識庫內容 (區段名稱 → 文字)，供 token 預算分別估算。
+    :param personal_omitted: 因 token 預算而省略個人明細時為 True。
+    """
+    sections: Dict[str, str] = {}
+    if retrieval_note:
+        sections[SECTION_NOTE] = f"（以下數據已依問題篩選：{retrieval_note}）\n\n"
     
     if df_summary is not None:
-        context += "### [1. 總結報表數據]\n"
-        context += "這是各區別的彙總數據，適合回答整體趨勢問題。\n"
-        context += df_summary.to_markdown(index=False) + "\n\n"
+        sections[SECTION_SUMMARY] = (
+            "### [1. 總結報表數據]\n"
+            "這是各區別的彙總數據，適合回答整體趨勢問題。\n"
+            + df_summary.to_markdown(index=False) + "\n\n"
+        )
         
-    if df_personal is not None:
-        context += "### [2. 個人原始點名明細]\n"
-        context += "這是每個人在每一週的出席狀況（1=出席, 0=缺席）。可用於跨週比對名單。\n"
-        context += df_personal.to_markdown(index=False) + "\n"
+    if personal_omitted:
+        sections[SECTION_PERSONAL] = "### [2. 個人原始點名明細]\n（資料量過大，本次未附個人明細，請依總結數據與出席洞察回答）\n"
+    elif df_personal is not None and not df_personal.empty:
+        sections[SECTION_PERSONAL] = (
+            "### [2. 個人原始點名明細]\n"
+            "這是每個人在每一週的出席狀況（1=出席, 0=缺席）。可用於跨週比對名單。\n"
+            + _encode_personal_compact(df_personal) + "\n"
+        )
+    elif df_personal is not None:
+        sections[SECTION_PERSONAL] = "### [2. 個人原始點名明細]\n（沒有符合篩選條件的個人明細）\n"
     else:
-        context += "### [⚠️ 注意]：目前無法讀取個人 Excel 資料，請檢查檔案名稱是否為 attend_YYYY-MM-DD.xlsx。\n"
+        sections[SECTION_PERSONAL] = "### [⚠️ 注意]：目前無法讀取個人 Excel 資料，請檢查檔案名稱是否為 attend_YYYY-MM-DD.xlsx。\n"
+
+    if insights_text:
+        sections[SECTION_INSIGHTS] = (
+            "\n### [3. 預先計算的出席洞察]\n"
+            "這是最近一週與上週比較後的事實（人數增減、新缺席、回來、連續缺席），回答跨週比較問題時請優先引用。\n"
+            + insights_text + "\n"
+        )
         
-    return context
+    return sections
+
+
+def _recent_personal_rows(df_personal: Optional[pd.DataFrame], weeks: int) -> Optional[pd.DataFrame]:
+    if df_personal is None or df_personal.empty:
+        return df_personal
+    recent = sorted(df_personal["日期"].astype(str).unique(), reverse=True)[:weeks]
+    return df_personal[df_personal["日期"].astype(str).isin(recent)]
+
+
+def _budgeted_context(df_summary: Optional[pd.DataFrame], df_personal: Optional[pd.DataFrame],
+                      retrieval_note: Optional[str], insights_text: Optional[str],
+                      reserved_tokens: int, full_sections: Optional[Dict[str, str]] = None) -> str:
+    """
+    組合符合 token 預算的知識庫：完整個人明細 → 最近幾週的個人明細 → 只有彙總數據。
+    :param full_sections: 已生成好的完整區段 (例如 GLOBAL_RAG_SECTIONS)，第一級直接沿用。
+    """
+    def full_level():
+        if full_sections is not None:
+            return full_sections
+        return _render_rag_sections(df_summary, df_personal, retrieval_note, insights_text)
+
+    levels = [
+        context_budget.BudgetLevel("完整個人明細", full_level),
+        context_budget.BudgetLevel(
+            f"最近 {BUDGET_PERSONAL_WEEKS} 週的個人明細",
+            lambda: _render_rag_sections(df_summary, _recent_personal_rows(df_personal, BUDGET_PERSONAL_WEEKS),
+                                         retrieval_note, insights_text),
+        ),
+        context_budget.BudgetLevel(
+            "只有彙總數據",
+            lambda: _render_rag_sections(df_summary, None, retrieval_note, insights_text, personal_omitted=True),
+        ),
+    ]
+    count_tokens = LLM.count_tokens if LLM is not None else llm_backend.estimate_tokens
+    return context_budget.fit_to_budget(levels, count_tokens, reserved_tokens)
+
 
 GLOBAL_RAG_CONTEXT = "數據初始化中，請稍候..."
+# GLOBAL_RAG_CONTEXT 的各區段 (token 預算估算用)
+GLOBAL_RAG_SECTIONS: Dict[str, str] = {}
+# 知識庫的原始表格 (總結數據, 個人明細)，供依問題檢索使用
+GLOBAL_RAG_DATA: Tuple[Optional[pd.DataFrame], Optional[pd.DataFrame]] = (None, None)
+# 預先計算的出席洞察 {區別: [事實, ...]}
+GLOBAL_RAG_INSIGHTS: Dict[str, List[str]] = {}
+# 歷史上所有聖徒的姓名索引 (「查 <姓名>」指令)
+GLOBAL_MEMBER_INDEX = member_index.MemberIndex([])
+MEMBER_TIMELINE_WEEKS = 12
+FUZZY_WINNER_MARGIN = 0.15
+# 目前快取所對應的倉儲資料版本；版本未變時不需重建
+_RAG_CONTEXT_DATA_VERSION: Optional[str] = None
+
+
+class RagPartition(NamedTuple):
+    """只包含部分小區的知識庫 (供只關心自己區域的 LINE 群組使用)。"""
+    districts: Tuple[str, ...]
+    data: Tuple[Optional[pd.DataFrame], Optional[pd.DataFrame]]
+    sections: Dict[str, str]
+    insights: Dict[str, List[str]]
+
+
+# 依小區範圍切分的知識庫 {(小區, ...): RagPartition}，每個大區與每個群組設定各一份
+GLOBAL_RAG_PARTITIONS: Dict[Tuple[str, ...], RagPartition] = {}
+# LINE 群組 → 該群組的小區範圍 (來自 Sheets 的 Config 分頁)
+GROUP_RAG_SCOPES: Dict[str, Tuple[str, ...]] = {}
+
+
+def _known_districts() -> set:
+    """目前知識庫中出現過的小區。"""
+    return {str(d) for df in GLOBAL_RAG_DATA if df is not None for d in df["區別"].dropna().unique()}
+
+
+def resolve_districts(regions: List[str], known_districts: Optional[set] = None) -> Tuple[str, ...]:
+    """
+    將大區名稱展開成所屬小區 (小區名稱原樣保留)，回傳排序後的小區範圍。
+    包含「總計」時回傳空範圍，代表使用全教會的知識庫；
+    提供 known_districts 時會略過資料中不存在的名稱並記錄警告，全部無效時同樣回傳空範圍。
+    """
+    if TOTAL_REGION_NAME in regions:
+        return ()
+    districts = set()
+    for region in regions:
+        subdistricts = REGION_MAPPING.get(region, [region])
+        if known_districts is not None and not known_districts.intersection(subdistricts):
+            print(f"⚠ 未知的區域名稱「{region}」，已略過 (請檢查 Config 設定)")
+            continue
+        districts.update(subdistricts)
+    return tuple(sorted(districts))
+
+
+def _build_rag_partition(districts: Tuple[str, ...]) -> RagPartition:
+    df_summary, df_personal = GLOBAL_RAG_DATA
+    if df_summary is not None:
+        df_summary = df_summary[df_summary["區別"].astype(str).isin(districts)]
+    if df_personal is not None:
+        df_personal = df_personal[df_personal["區別"].astype(str).isin(districts)]
+    insights = attendance_insights.compute_insights(df_summary, df_personal)
+    sections = _render_rag_sections(df_summary, df_personal, insights_text=attendance_insights.render_insights(insights))
+    return RagPartition(districts, (df_summary, df_personal), sections, insights)
+
+
+def _refresh_rag_partitions(group_regions: Optional[Dict[str, List[str]]], rebuild: bool) -> None:
+    """
+    建立各大區與各群組所需的知識庫分區。
+    :param group_regions: {群組 ID: [大區或小區, ...]}；None 表示沿用上次的群組設定。
+    :param rebuild: 知識庫已重建時為 True，所有分區重新產生；否則只補上新出現的範圍。
+    """
+    global GLOBAL_RAG_PARTITIONS, GROUP_RAG_SCOPES
+    if group_regions is not None:
+        known_districts = _known_districts()
+        scopes_by_group = {gid: resolve_districts(regions, known_districts) for gid, regions in group_regions.items()}
+        # 範圍為空 (總計或全部名稱無效) 的群組不建立分區，直接使用全教會的知識庫
+        GROUP_RAG_SCOPES = {gid: districts for gid, districts in scopes_by_group.items() if districts}
+
+    scopes = {resolve_districts([region]) for region in REGION_MAPPING}
+    scopes.update(GROUP_RAG_SCOPES.values())
+    existing = {} if rebuild else GLOBAL_RAG_PARTITIONS
+    # 不再被任何大區或群組使用的分區一併移除
+    GLOBAL_RAG_PARTITIONS = {
+        districts: existing.get(districts) or _build_rag_partition(districts)
+        for districts in scopes if districts
+    }
+
 
 # ... (保留原有的字體設定、模型設定) ...
 
-def update_global_rag_context(reports_dir_summary: str, reports_dir_excel: str):
+def update_global_rag_context(reports_dir_summary: str, reports_dir_excel: str, force: bool = False,
+                              group_regions: Optional[Dict[str, List[str]]] = None):
     """
-    手動觸發：重新讀取 Excel 並更新全局快取文字。
+    手動觸發：重新讀取資料並更新全局快取文字，以及各大區 / 各群組的知識庫分區。
+    若倉儲資料版本與上次建立快取時相同，則略過重建 (除非 force=True)。
+    :param group_regions: Sheets Config 的群組設定 {群組 ID: [大區, ...]}；None 表示沿用上次的設定。
     """
-    global GLOBAL_RAG_CONTEXT
+    global GLOBAL_RAG_CONTEXT, GLOBAL_RAG_SECTIONS, GLOBAL_RAG_DATA, GLOBAL_RAG_INSIGHTS, GLOBAL_MEMBER_INDEX
+    global _RAG_CONTEXT_DATA_VERSION, _RAG_CONTEXT_HASH
+    data_version = attendance_store.data_version()
+    if not force and data_version is not None and data_version == _RAG_CONTEXT_DATA_VERSION:
+        print("⏭️ 數據未變動，沿用現有 RAG 知識庫快取。")
+        _refresh_rag_partitions(group_regions, rebuild=False)
+        return
+
     print("🔄 正在重新構建 RAG 知識庫快取...")
     try:
-        # 呼叫您原有的 generate 函式取得文字
-        new_context = _generate_rag_context(reports_dir_summary, reports_dir_excel)
+        rag_frames = _load_rag_frames(reports_dir_summary, reports_dir_excel)
+        insights = attendance_insights.compute_insights(*rag_frames)
+        new_sections = _render_rag_sections(*rag_frames, insights_text=attendance_insights.render_insights(insights))
+        new_context = "".join(new_sections.values())
+        # 從 Excel 匯入的歷史週次一併補入出席事實表；
+        # 同步失敗 (例如 SQLite 被鎖定) 只影響姓名索引的歷史，不應捨棄新的知識庫
+        try:
+            attendance_db.sync_from_store()
+        except Exception as e:
+            print(f"⚠ 出席資料庫同步失敗，沿用既有資料: {e}")
+        new_member_index = _build_member_index(rag_frames[1])
+        new_context_hash = hashlib.sha256(new_context.encode("utf-8")).hexdigest()
         GLOBAL_RAG_CONTEXT = new_context
-        print(f"✅ 知識庫快取更新完成 (字數: {len(GLOBAL_RAG_CONTEXT)})")
+        GLOBAL_RAG_SECTIONS = new_sections
+        GLOBAL_RAG_DATA = rag_frames
+        GLOBAL_RAG_INSIGHTS = insights
+        GLOBAL_MEMBER_INDEX = new_member_index
+        _refresh_rag_partitions(group_regions, rebuild=True)
+        if new_context_hash != _RAG_CONTEXT_HASH:
+            # 知識庫內容改變，舊的回答全部失效
+            _RAG_CONTEXT_HASH = new_context_hash
+            clear_rag_response_cache()
+        # 建立過程中可能從 Excel 匯入新週次，因此以建立後的版本為準
+        _RAG_CONTEXT_DATA_VERSION = attendance_store.data_version()
+        print(f"✅ 知識庫快取更新完成 (字數: {len(GLOBAL_RAG_CONTEXT)}，分區 {len(GLOBAL_RAG_PARTITIONS)} 個)")
         gc.collect()
     except Exception as e:
         print(f"❌ 快取更新失敗: {e}")
 
+def _build_member_index(df_personal: Optional[pd.DataFrame]) -> member_index.MemberIndex:
+    """以出席資料庫的完整歷史為主，再補上個人明細中 (資料庫尚未收錄) 的姓名。"""
+    members = []
+    try:
+        members = attendance_db.member_directory()
+    except Exception as e:
+        print(f"⚠ 無法從出席資料庫讀取姓名清單: {e}")
+    if df_personal is not None and not df_personal.empty:
+        latest = df_personal.drop_duplicates("姓名", keep="last")
+        members += list(zip(latest["姓名"].astype(str), latest["區別"].astype(str)))
+    return member_index.MemberIndex(members)
+
+
+def lookup_member(name_query: str) -> str:
+    """
+    「查 <姓名>」指令：以姓名索引找到聖徒，回傳近 MEMBER_TIMELINE_WEEKS 週的出席紀錄 (不經過 Gemini)。
+    找到多位候選時列出候選名單，請使用者輸入完整姓名。
+    """
+    matches, total = GLOBAL_MEMBER_INDEX.lookup_with_total(name_query)
+    if not matches:
+        return f"🔍 查無「{name_query}」，請確認姓名是否正確。"
+
+    names = list(dict.fromkeys(m.name for m in matches))
+    # 模糊比對時，若第一名明顯比其他候選更接近就直接採用；
+    # 前綴比對 (例如只輸入姓氏) 有多位候選時一律列出，讓使用者選擇
+    clear_winner = (matches[0].kind == "fuzzy" and len(matches) > 1
+                    and matches[0].score - matches[1].score >= FUZZY_WINNER_MARGIN)
+    if len(names) > 1 and not clear_winner:
+        candidates = "、".join(f"{m.name}（{m.district}）" if m.district else m.name for m in matches)
+        if total > len(matches):
+            return (f"🔍 「{name_query}」共符合 {total} 位聖徒，以下僅列出前 {len(matches)} 位，"
+                    f"請多輸入幾個字或輸入完整姓名：\n{candidates}")
+        return f"🔍 找到多位可能的聖徒，請輸入完整姓名：\n{candidates}"
+
+    match = matches[0]
+    note = None if match.kind == "exact" else f"（依「{name_query}」找到最接近的姓名：{match.name}）"
+    try:
+        timeline = attendance_db.member_history(match.name, weeks=MEMBER_TIMELINE_WEEKS)
+    except Exception as e:
+        print(f"⚠ 出席資料庫查詢失敗，改用記憶體中的個人明細: {e}")
+        timeline = pd.DataFrame()
+    if timeline.empty:
+        timeline = local_query_engine.personal_timeline(GLOBAL_RAG_DATA[1], match.name)
+    return local_query_engine.format_member_timeline(match.name, timeline, note)
+
+
 # -----------------------------------------------------------
 # 總 RAG 響應生成函式 (統一處理所有查詢)
 # -----------------------------------------------------------
-def generate_rag_response(reports_dir_summary: str, reports_dir_excel: str, query: str) -> str:
+def _build_query_context(query: str, reserved_tokens: int = 0, partition: Optional[RagPartition] = None) -> str:
     """
-    統一 RAG 函式：生成上下文並傳遞給 Gemini 進行推理。
+    依問題中的姓名、區別、日期與項目，只挑出相關的資料列組成上下文，並控制在 token 預算內。
+    :param reserved_tokens: 系統提示與問題本身佔用的 token 數。
+    :param partition: 群組專屬的知識庫分區；None 表示使用全教會的知識庫。
     """
-    if not model:
-        return "❌ RAG 功能未啟用，請檢查 Gemini API Key 設定。"
+    if partition is not None:
+        (df_summary, df_personal), sections, insights = partition.data, partition.sections, partition.insights
+    else:
+        (df_summary, df_personal), sections, insights = GLOBAL_RAG_DATA, GLOBAL_RAG_SECTIONS, GLOBAL_RAG_INSIGHTS
+    if df_summary is None and df_personal is None:
+        return GLOBAL_RAG_CONTEXT
 
-    # 1. 獲取所有檔案濃縮成的核心數據上下文
-    rag_context = GLOBAL_RAG_CONTEXT
-    
-    # 2. 準備系統提示
+    def full_context():
+        insights_text = attendance_insights.render_insights(insights)
+        return _budgeted_context(df_summary, df_personal, None, insights_text, reserved_tokens, sections)
+
+    try:
+        retrieval = rag_retrieval.retrieve(query, df_summary, df_personal, REGION_MAPPING)
+    except Exception as e:
+        print(f"⚠ 問題檢索失敗，改用完整知識庫: {e}")
+        return full_context()
+
+    if retrieval is None:
+        return full_context()
+    insights_text = attendance_insights.render_insights(insights, retrieval.filters.districts)
+    context = _budgeted_context(retrieval.summary, retrieval.personal, retrieval.filters.describe(),
+                                insights_text, reserved_tokens)
+    print(f"🔎 依問題檢索：{retrieval.filters.describe()} (字數 {len(''.join(sections.values()))} → {len(context)})")
+    return context
+
+
+def _group_partition(group_id: Optional[str]) -> Optional[RagPartition]:
+    """群組在 Config 中有設定範圍時回傳其知識庫分區，否則回傳 None (使用全教會知識庫)。"""
+    districts = GROUP_RAG_SCOPES.get(group_id) if group_id else None
+    return GLOBAL_RAG_PARTITIONS.get(districts) if districts else None
+
+
+def answer_locally(query: str) -> Optional[str]:
+    """
+    常見的結構化問題 (人數、缺席名單、跨週比較、連續缺席) 直接由本地資料計算答案。
+    :return: 答案文字；屬於開放式問題時回傳 None，應改用 generate_rag_response。
+    """
+    df_summary, df_personal = GLOBAL_RAG_DATA
+    if df_summary is None and df_personal is None:
+        return None
+    try:
+        return local_query_engine.answer(query, df_summary, df_personal, REGION_MAPPING)
+    except Exception as e:
+        print(f"⚠ 本地問答失敗，改用 Gemini: {e}")
+        return None
+
+
+# --- Gemini 回答快取 ---
+# 以 (知識庫內容雜湊, 知識庫分區的小區範圍, 正規化後的問題) 為鍵，LRU 淘汰；知識庫重建時整批失效。
+# 相同問題若已有呼叫進行中，後到的請求會等待該次結果，不重複呼叫 Gemini。
+RAG_RESPONSE_CACHE_SIZE = int(os.environ.get("RAG_RESPONSE_CACHE_SIZE", 128))
+RAG_INFLIGHT_WAIT_SECONDS = 120
+_RESPONSE_CACHE: "OrderedDict[Tuple[str, Tuple[str, ...], str], str]" = OrderedDict()
+_INFLIGHT_RESPONSES: Dict[Tuple[str, Tuple[str, ...], str], Future] = {}
+_RESPONSE_CACHE_LOCK = threading.Lock()
+_RAG_CONTEXT_HASH = hashlib.sha256(GLOBAL_RAG_CONTEXT.encode("utf-8")).hexdigest()
+
+
+def _normalize_query(query: str) -> str:
+    """全形轉半形、去除多餘空白與句尾標點，讓寫法略有不同的相同問題共用快取。"""
+    normalized = unicodedata.normalize("NFKC", query).strip().lower()
+    normalized = re.sub(r"\s+", " ", normalized)
+    return normalized.rstrip("?!.。？！~ ")
+
+
+def clear_rag_response_cache() -> None:
+    with _RESPONSE_CACHE_LOCK:
+        _RESPONSE_CACHE.clear()
+
+
+def _generate_uncached(query: str, partition: Optional[RagPartition] = None) -> str:
+    # 1. 準備系統提示
     system_prompt = f"""
     你是一個智慧的教會數據分析機器人。你的目標是根據用戶的問題和下方提供的『RAG 數據知識庫』來生成精確、簡潔且有條理的答案。
     
     數據欄位說明：
     - A 區塊用於回答總結趨勢和區別比較問題。
     - B 區塊是**原始的、未聚合的個人數據**，可用於回答**任何**個人相關問題，包括跨週比較（例如：上週有來這週沒來的人、某位聖徒在五週內的出席趨勢）。
+    - C 區塊是**預先計算好的出席洞察**（人數增減、新缺席、回來、連續缺席），相關問題請直接引用，不需自行重新推算。
     
     請利用提供的數據知識庫進行分析和回答。
     """
+
+    # 2. 依問題檢索相關的資料列 (問題中沒有可用條件時才使用完整知識庫)，並扣除系統提示與問題的 token 數
+    count_tokens = LLM.count_tokens if LLM is not None else llm_backend.estimate_tokens
+    rag_context = _build_query_context(query, reserved_tokens=count_tokens(system_prompt + query), partition=partition)
     
     # 3. 結合上下文和用戶查詢
     full_prompt = f"{system_prompt}\n\n{rag_context}\n\n---\n\n用戶問題：{query}"
 
     try:
-        # 4. 呼叫 Gemini
-        response = model.generate_content(full_prompt)
+        # 4. 呼叫 LLM 後端
+        answer = LLM.generate(full_prompt)
         gc.collect()
-        return response.text
+        return answer
     except Exception as e:
         gc.collect()
-        return f"❌ RAG 處理失敗 (Gemini API 錯誤): {e}"
+        return f"❌ RAG 處理失敗 ({LLM.name} API 錯誤): {e}"
+
+
+def generate_rag_response(reports_dir_summary: str, reports_dir_excel: str, query: str,
+                          group_id: Optional[str] = None) -> str:
+    """
+    統一 RAG 函式：生成上下文並傳遞給 Gemini 進行推理。
+    相同知識庫下的相同問題直接回傳快取答案；進行中的相同問題會共用同一次呼叫。
+    :param group_id: LINE 群組 ID；群組在 Config 中設定了區域時，只使用該區域的知識庫分區。
+    """
+    if LLM is None:
+        return "❌ RAG 功能未啟用，請檢查 Gemini API Key 設定。"
+
+    partition = _group_partition(group_id)
+    scope = partition.districts if partition is not None else ()
+    cache_key = (_RAG_CONTEXT_HASH, scope, _normalize_query(query))
+    with _RESPONSE_CACHE_LOCK:
+        cached = _RESPONSE_CACHE.get(cache_key)
+        if cached is not None:
+            _RESPONSE_CACHE.move_to_end(cache_key)
+            print("💾 使用快取的回答")
+            return cached
+        inflight = _INFLIGHT_RESPONSES.get(cache_key)
+        is_leader = inflight is None
+        if is_leader:
+            inflight = Future()
+            _INFLIGHT_RESPONSES[cache_key] = inflight
+
+    if not is_leader:
+        print("⏳ 相同問題正在處理中，等待其結果...")
+        try:
+            return inflight.result(timeout=RAG_INFLIGHT_WAIT_SECONDS)
+        except Exception as e:
+            return f"❌ RAG 處理失敗: {e}"
+
+    try:
+        answer = _generate_uncached(query, partition)
+        inflight.set_result(answer)
+    except BaseException as e:
+        inflight.set_exception(e)
+        raise
+    finally:
+        with _RESPONSE_CACHE_LOCK:
+            _INFLIGHT_RESPONSES.pop(cache_key, None)
+
+    # 錯誤訊息不寫入快取；知識庫已在呼叫期間更新時也不寫入 (鍵已過期)
+    if not answer.startswith("❌"):
+        with _RESPONSE_CACHE_LOCK:
+            if cache_key[0] == _RAG_CONTEXT_HASH:
+                _RESPONSE_CACHE[cache_key] = answer
+                _RESPONSE_CACHE.move_to_end(cache_key)
+                while len(_RESPONSE_CACHE) > RAG_RESPONSE_CACHE_SIZE:
+                    _RESPONSE_CACHE.popitem(last=False)
+    return answer
 
 def parse_week_end_date_from_filename(filename: str) -> Optional[datetime]:
     """
@@ -285,17 +741,157 @@ def _remove_summary_rows(df: pd.DataFrame) -> pd.DataFrame:
     return df[~mask_summary].copy()
 
 
-def aggregate_reports(reports_dir: str) -> pd.DataFrame:
-    pattern = os.path.join(reports_dir, "*.xls*") 
-    file_paths = sorted(glob.glob(pattern))
+def _load_summary_excel(file_path: str) -> Optional[pd.DataFrame]:
+    """讀取單一份總結 Excel，供倉儲匯入使用 (週次由倉儲分割檔名記錄)。"""
+    report_df = read_single_report(file_path)
+    if report_df is None:
+        return None
+    return report_df.drop(columns=["週末日"])
+
+
+def _read_summary_partition(path: str) -> Optional[pd.DataFrame]:
+    """讀取倉儲中單一週的總結分割檔，整理成與 read_single_report 相同的格式。"""
+    week_end_date = parse_week_end_date_from_filename(path)
+    if week_end_date is None:
+        return None
+    try:
+        dataframe = attendance_store.read_partition(path)
+    except Exception as e:
+        print(f"⚠ 無法讀取倉儲分割檔 {path}: {e}")
+        return None
+
+    dataframe = _clean_table_headers(dataframe)
+    if "區別" not in dataframe.columns:
+        return None
+    dataframe = _coerce_numeric_columns(dataframe)
+    dataframe["週末日"] = week_end_date
+
+    keep_columns = ["區別", "週末日"] + [
+        col for col in NUMERIC_COLUMNS_CANDIDATES if col in dataframe.columns
+    ]
+    return dataframe[keep_columns]
+
+
+def _read_member_partition_for_summary(path: str) -> Optional[pd.DataFrame]:
+    """讀取倉儲中單一週的個人明細 (只解碼 '區別' 與出席欄位)，供彙總使用。"""
+    week_end_date = parse_week_end_date_from_filename(path)
+    if week_end_date is None:
+        return None
+    try:
+        dataframe = attendance_store.read_partition(path, columns=["區別"] + NUMERIC_COLUMNS_CANDIDATES)
+    except Exception as e:
+        print(f"⚠ 無法讀取倉儲分割檔 {path}: {e}")
+        return None
+
+    if "區別" not in dataframe.columns:
+        return None
+    dataframe["週末日"] = week_end_date
+    return dataframe
+
+
+def _list_summary_sources(reports_dir: str, reports_dir_excel: str) -> List[Tuple[str, Callable[[str], Optional[pd.DataFrame]]]]:
+    """
+    列出總結數據的來源檔案與對應的讀取函式。
+    優先以倉儲中的個人明細即時彙總；只有缺少個人明細的週次才使用總結分割檔。
+    倉儲停用時退回讀取總結 Excel。
+    """
+    if attendance_store.PARQUET_AVAILABLE:
+        attendance_store.import_excel_history(
+            attendance_store.MEMBERS_DATASET,
+            os.path.join(reports_dir_excel, "attend_*.xls*"),
+            _load_attend_excel,
+            parse_week_end_date_from_filename,
+        )
+        attendance_store.import_excel_history(
+            attendance_store.SUMMARY_DATASET,
+            os.path.join(reports_dir, "*.xls*"),
+            _load_summary_excel,
+            parse_week_end_date_from_filename,
+            # 已有個人明細的週次直接即時彙總，不必解析總結 Excel
+            covered_by=attendance_store.MEMBERS_DATASET,
+        )
+        member_partitions = attendance_store.list_partitions(attendance_store.MEMBERS_DATASET)
+        member_weeks = {week_date for week_date, _ in member_partitions}
+        sources = [(path, _read_member_partition_for_summary) for _, path in member_partitions]
+        sources += [
+            (path, _read_summary_partition)
+            for week_date, path in attendance_store.list_partitions(attendance_store.SUMMARY_DATASET)
+            if week_date not in member_weeks
+        ]
+        if sources:
+            return sources
+
+    pattern = os.path.join(reports_dir, "*.xls*")
+    return [(path, read_single_report) for path in sorted(glob.glob(pattern))]
+
+
+def summarize_weeks(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """
+    將多週的個人明細 (或已彙總的總結表) 以一次 groupby 彙總成 區別 × 週末日 的總結數據。
+    已彙總的總結表每週每區只有一列，加總後結果不變，因此兩種來源可混合傳入。
+    """
+    combined = pd.concat(frames, ignore_index=True)
+    combined["區別"] = combined["區別"].astype(object)
+    numeric_columns = [col for col in NUMERIC_COLUMNS_CANDIDATES if col in combined.columns]
+    combined = _coerce_numeric_columns(combined)
+    summary = combined.groupby(["週末日", "區別"], sort=False)[numeric_columns].sum()
+    # uint8 加總後為 uint64，轉回 int64 以免後續相減 (週對週差異) 時溢位
+    summary = summary.astype("int64").reset_index()
+    return summary[["區別", "週末日"] + numeric_columns]
+
+
+# --- 總結數據快取 ---
+# 以 (路徑, mtime, 檔案大小) 判斷檔案是否變動：
+# 目錄未變動時每個檔案只需一次 stat()；新增一週時只需解析該週的檔案。
+_REPORT_FILE_CACHE: Dict[str, Tuple[Tuple[int, int], Optional[pd.DataFrame]]] = {}
+_AGGREGATE_CACHE: Dict[Tuple[str, str], Tuple[tuple, pd.DataFrame]] = {}
+_REPORT_CACHE_LOCK = threading.Lock()
+
+
+def _file_signature(path: str) -> Tuple[int, int]:
+    stat_result = os.stat(path)
+    return stat_result.st_mtime_ns, stat_result.st_size
+
+
+def _read_report_cached(path: str, loader: Callable[[str], Optional[pd.DataFrame]],
+                        signature: Tuple[int, int]) -> Optional[pd.DataFrame]:
+    with _REPORT_CACHE_LOCK:
+        cached = _REPORT_FILE_CACHE.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    report_df = loader(path)
+    with _REPORT_CACHE_LOCK:
+        _REPORT_FILE_CACHE[path] = (signature, report_df)
+    return report_df
+
+
+def aggregate_reports(reports_dir: str, reports_dir_excel: Optional[str] = None) -> pd.DataFrame:
+    """
+    彙總所有週次的各區別人數 (區別 × 週末日)。
+    優先由倉儲中的個人明細即時計算，不再經由總結 Excel 來回讀寫。
+    :param reports_dir: 總結 Excel 資料夾 (僅作為舊資料匯入與無倉儲時的來源)。
+    :param reports_dir_excel: 個人點名 Excel 資料夾，預設為專案下的 reports_excel。
+    """
+    reports_dir_excel = reports_dir_excel or DEFAULT_REPORTS_DIR_EXCEL
+    sources = _list_summary_sources(reports_dir, reports_dir_excel)
     
-    if not file_paths:
+    if not sources:
         raise RuntimeError(f"在資料夾 '{reports_dir}' 中找不到報表檔案。")
 
+    signatures = [_file_signature(path) for path, _ in sources]
+    directory_signature = tuple(zip((path for path, _ in sources), signatures))
+    cache_key = (reports_dir, reports_dir_excel)
+
+    with _REPORT_CACHE_LOCK:
+        cached = _AGGREGATE_CACHE.get(cache_key)
+    if cached is not None and cached[0] == directory_signature:
+        return cached[1].copy()
+
     combined: List[pd.DataFrame] = []
     processed_count = 0
-    for path in file_paths:
-        report_df = read_single_report(path)
+    for (path, loader), signature in zip(sources, signatures):
+        report_df = _read_report_cached(path, loader, signature)
         if report_df is not None:
             combined.append(report_df)
             processed_count += 1
@@ -303,67 +899,97 @@ def aggregate_reports(reports_dir: str) -> pd.DataFrame:
     if not combined:
         raise RuntimeError("沒有任何可用的報表資料。")
 
-    all_data = pd.concat(combined, ignore_index=True)
+    all_data = summarize_weeks(combined)
 
     all_data = _remove_summary_rows(all_data)
-    all_data.sort_values("週末日", inplace=True)
+    all_data["區別"] = all_data["區別"].astype("category")
+    all_data.sort_values(["週末日", "區別"], inplace=True)
+    all_data.reset_index(drop=True, inplace=True)
 
     unique_weeks = all_data["週末日"].dropna().unique()
-    print(f"📦 已讀取 {processed_count}/{len(file_paths)} 份總結報表；週數: {len(unique_weeks)} ({', '.join(pd.Series(unique_weeks).dt.strftime('%Y/%m/%d'))})")
+    print(f"📦 已讀取 {processed_count}/{len(sources)} 週資料；週數: {len(unique_weeks)} ({', '.join(pd.Series(unique_weeks).dt.strftime('%Y/%m/%d'))})")
 
-    return all_data
+    with _REPORT_CACHE_LOCK:
+        # 只保留仍存在的檔案，避免已刪除的週次殘留在快取中
+        live_paths = {path for path, _ in sources}
+        live_dirs = {os.path.dirname(path) for path in live_paths}
+        stale_paths = [
+            path for path in _REPORT_FILE_CACHE
+            if path not in live_paths and os.path.dirname(path) in live_dirs
+        ]
+        for stale_path in stale_paths:
+            del _REPORT_FILE_CACHE[stale_path]
+        _AGGREGATE_CACHE[cache_key] = (directory_signature, all_data)
 
+    return all_data.copy()
 
-def build_region_timeseries(all_reports: pd.DataFrame, region_name: str) -> pd.DataFrame:
-    """
-    根據名稱 (總計, 區別/小區, 或大區) 建立時間序列數據。
-    """
-    
-    if region_name == "總計":
-        region_df = all_reports.copy()
-    
-    # 🚨 修正: 處理大區名稱 (即在 REGION_MAPPING 中的 Key)
-    elif region_name in REGION_MAPPING:
-        subdistricts = REGION_MAPPING[region_name]
-        # 過濾出屬於該大區的所有小區數據
-        region_df = all_reports[all_reports["區別"].isin(subdistricts)].copy()
-        print(f"   -> 匯總 {region_name}: 包含 {', '.join(subdistricts)}")
-        
-    # 處理小區名稱 (即在 '區別' 欄位中的值)
-    else:
-        region_df = all_reports[all_reports["區別"] == region_name].copy()
-    
-    
-    if region_df.empty:
-        return pd.DataFrame()
 
-    aggregation_columns = [col for col in NUMERIC_COLUMNS_CANDIDATES if col in region_df.columns]
-    
-    # 執行分組加總 (如果是大區或總計，則會將多個小區的數據加總)
-    ts = region_df.groupby("週末日")[aggregation_columns].sum().sort_index()
+TOTAL_REGION_NAME = "總計"
+
 
+def _with_total_visits(ts: pd.DataFrame) -> pd.DataFrame:
     # 計算總出訪 (使用 API 欄位名稱)
     gospel = ts["福出訪"] if "福出訪" in ts.columns else 0
     home = ts["家出訪"] if "家出訪" in ts.columns else 0
     ts["總出訪"] = gospel + home
-        
     return ts
 
 
+def build_all_region_timeseries(all_reports: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """
+    一次算出區域階層中所有節點的週時間序列：總計、每個大區、每個小區。
+    只對原始資料做一次 (區別, 週末日) 分組加總，大區與總計再由小區結果加總，
+    成本不隨區域數量增加。
+    :return: {區域名稱: 以週末日為 index 的 DataFrame}；沒有資料的區域不會出現在結果中。
+    """
+    if all_reports is None or all_reports.empty:
+        return {}
+
+    aggregation_columns = [col for col in NUMERIC_COLUMNS_CANDIDATES if col in all_reports.columns]
+    # 區別為空的列只計入總計
+    by_district = all_reports.groupby(["區別", "週末日"], observed=True, dropna=False)[aggregation_columns].sum()
+
+    result: Dict[str, pd.DataFrame] = {
+        TOTAL_REGION_NAME: _with_total_visits(by_district.groupby(level="週末日").sum().sort_index())
+    }
+
+    district_level = by_district.index.get_level_values("區別")
+    for region_name, subdistricts in REGION_MAPPING.items():
+        in_region = district_level.isin(subdistricts)
+        if in_region.any():
+            region_ts = by_district[in_region].groupby(level="週末日").sum().sort_index()
+            result[region_name] = _with_total_visits(region_ts)
+
+    for district, district_ts in by_district.groupby(level="區別", observed=True):
+        result.setdefault(str(district), _with_total_visits(district_ts.droplevel("區別").sort_index()))
+    return result
+
+
+def build_region_timeseries(all_reports: pd.DataFrame, region_name: str) -> pd.DataFrame:
+    """
+    根據名稱 (總計, 區別/小區, 或大區) 建立時間序列數據。
+    需要多個區域時請改用 build_all_region_timeseries，只需計算一次。
+    """
+    return build_all_region_timeseries(all_reports).get(region_name, pd.DataFrame())
+
+
 def _format_date_axis(ax, dates=None):
     if dates is not None:
         ax.set_xticks(pd.Index(dates))
     ax.xaxis.set_major_formatter(mdates.DateFormatter("%Y/%m/%d"))
-    plt.setp(ax.get_xticklabels(), rotation=45, ha="right", fontsize=11)
+    for label in ax.get_xticklabels():
+        label.set(rotation=45, ha="right", fontsize=11)
     ax.tick_params(axis="y", labelsize=11)
     ax.margins(y=0.15)
     ax.grid(True, alpha=0.3)
 
 
-def _annotate_series(ax, x_index: pd.Index, y_series: pd.Series, fontsize: int = 12):
+def _annotate_series(ax, x_index: pd.Index, y_series: pd.Series, fontsize: int = 12) -> list:
+    """在每個大於 0 的資料點上方標註數字，回傳建立的標註 (供版面重複使用時移除)。"""
+    annotations = []
     for x, y in zip(x_index, y_series):
         if y > 0:
-            ax.annotate(
+            annotations.append(ax.annotate(
                 f"{int(y)}",
                 (x, y),
                 textcoords="offset points",
@@ -373,102 +999,197 @@ def _annotate_series(ax, x_index: pd.Index, y_series: pd.Series, fontsize: int =
                 bbox=dict(boxstyle="round,pad=0.2", fc="white", ec="none", alpha=0.8),
                 zorder=3,
                 clip_on=False,
-            )
-
-def _finalize_plot(plt_obj, output_path):
-    """🚨 統一處理圖表輸出與記憶體清理"""
-    plt_obj.tight_layout()
+            ))
+    return annotations
+
+def _save_figure(fig: Figure, output_path: str):
+    """統一處理圖表輸出"""
+    fig.tight_layout()
+    # 先寫入暫存檔再 os.replace，多個執行緒同時產生同一張圖時不會讀到寫到一半的檔案
+    tmp_path = f"{output_path}.{threading.get_ident()}.tmp"
     # 🚨 降低 DPI 以減少記憶體佔用與檔案大小 (80-90 適合手機顯示)
-    plt_obj.savefig(output_path, dpi=85) 
-    plt_obj.clf()
-    plt_obj.close('all')
-    gc.collect() # 💡 強制垃圾回收
+    fig.savefig(tmp_path, dpi=CHART_DPI, format="png")
+    os.replace(tmp_path, output_path)
+
+
+# --- 圖表參數 (同時作為圖表快取簽章的一部分) ---
+# 修改繪圖程式碼 (而非以下參數) 時請遞增版本，讓既有圖檔全部重新產生
+CHART_RENDER_VERSION = 2
+CHART_DPI = 85
+CHART_WEEKS = 5
+CHART_FIGSIZE = (10, 6)
+# (欄位, 圖例文字, 顏色, 線型)
+ATTENDANCE_SERIES = [
+    ("主日", "當周主日人數", "red", "-"),
+    ("小排", "小排人數", "gold", "-"),
+    ("晨興", "晨興人數", "green", "-"),
+]
+BURDEN_SERIES = [
+    ("禱告", "禱告人數", "#00aaff", "-"),
+    ("總出訪", "總出訪人數", "#0044aa", "-"),
+    ("家受訪", "家受訪人數", "#66ccff", "-"),  # 總結報表中的 '家受訪'
+]
+
+
+def _chart_signature(title: str, ts: pd.DataFrame, series: List[Tuple[str, str, str, str]]) -> str:
+    """圖表內容的簽章：近五週的時間序列 + 標題、線條設定、尺寸、DPI、字體。"""
+    columns = [column for column, _, _, _ in series if column in ts.columns]
+    digest = hashlib.sha256()
+    digest.update(json.dumps({
+        "version": CHART_RENDER_VERSION,
+        "title": title,
+        "series": series,
+        "figsize": CHART_FIGSIZE,
+        "dpi": CHART_DPI,
+        "font": matplotlib.rcParams["font.family"],
+        "dates": [pd.Timestamp(d).isoformat() for d in ts.index],
+    }, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(ts[columns].astype("int64"), index=False).values.tobytes())
+    return digest.hexdigest()
+
+
+def _chart_sidecar_path(output_path: str) -> str:
+    return f"{output_path}.json"
+
+
+def _chart_is_current(output_path: str, signature: str) -> bool:
+    """圖檔存在且旁邊的簽章檔與本次相同時，不需重新繪製。"""
+    if not os.path.exists(output_path):
+        return False
+    try:
+        with open(_chart_sidecar_path(output_path), encoding="utf-8") as f:
+            return json.load(f).get("signature") == signature
+    except (OSError, ValueError):
+        return False
 
-def plot_attendance(region_name: str, ts: pd.DataFrame, output_dir: str) -> None:
-    # Only keep the last 5 weeks for plotting
-    ts = ts.tail(5)
-    if ts.empty or ts.sum().sum() == 0:
-        return
-        
-    plt.figure(figsize=(10, 6))
-    ax = plt.gca()
-
-    # 繪圖時使用的欄位名稱，請注意這裡仍使用 API 原始欄位名
-    columns_to_plot = [
-        ("主日", "當周主日人數", "red", "-"),
-        ("小排", "小排人數", "gold", "-"),
-        ("晨興", "晨興人數", "green", "-"),
-    ]
 
-    plotted_any = False
-    for column_key, label_text, color, linestyle in columns_to_plot:
-        if column_key in ts.columns and ts[column_key].sum() > 0:
-            ax.plot(ts.index, ts[column_key], label=label_text, color=color, linestyle=linestyle, marker="o", markersize=5, linewidth=2)
-            _annotate_series(ax, ts.index, ts[column_key], fontsize=12)
-            plotted_any = True
+def _record_chart_signature(output_path: str, signature: str) -> None:
+    tmp_path = f"{_chart_sidecar_path(output_path)}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"signature": signature}, f)
+    os.replace(tmp_path, _chart_sidecar_path(output_path))
 
-    if not plotted_any:
-        print(f"⚠ {region_name} 沒有可繪製的出席相關數據")
-        plt.close()
-        return
 
-    ax.set_title(f"{region_name} - 召會生活人數趨勢 (近五週)")
-    ax.set_xlabel("日期")
-    ax.set_ylabel("人數")
-    ax.legend(loc="upper left")
-    _format_date_axis(ax, dates=ts.index)
+# 圖表種類 → (檔名後綴, 標題樣式, 線條設定, 無資料時的說明)
+CHART_KINDS = {
+    "attendance": ("attendance", "{region} - 召會生活人數趨勢 (近五週)", ATTENDANCE_SERIES, "出席"),
+    "burden": ("burden", "{region} - 負擔領受程度趨勢 (近五週)", BURDEN_SERIES, "負擔"),
+}
 
-    os.makedirs(output_dir, exist_ok=True)
-    output_path = os.path.join(output_dir, f"{region_name}_attendance.png")
-    _finalize_plot(plt, output_path)
-    print(f"✅ 已輸出 {output_path}")
 
+def _chart_target(kind: str, region_name: str, ts: pd.DataFrame, output_dir: str) -> Tuple[str, str]:
+    """回傳 (圖檔路徑, 內容簽章)；ts 應已截取為近五週。"""
+    suffix, title_format, series, _ = CHART_KINDS[kind]
+    output_path = os.path.join(output_dir, f"{region_name}_{suffix}.png")
+    return output_path, _chart_signature(title_format.format(region=region_name), ts, series)
 
-def plot_burden(region_name: str, ts: pd.DataFrame, output_dir: str) -> None:
+
+class ChartTemplate:
+    """
+    某一種圖表 (出席 / 負擔) 的可重複使用版面。
+    Figure、Agg 畫布、座標軸與線條只建立一次；之後每張圖只更新線條資料、數字標註、標題與圖例。
+    不使用 pyplot 的全域狀態，但同一個版面不可跨執行緒共用 (見 _chart_template)。
+    """
+
+    def __init__(self, kind: str):
+        self.series = CHART_KINDS[kind][2]
+        self.fig = Figure(figsize=CHART_FIGSIZE)
+        FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot()
+        self.ax.set_xlabel("日期")
+        self.ax.set_ylabel("人數")
+        self.lines = {}         # 欄位 → Line2D (第一次需要時才建立，以便座標軸取得日期單位)
+        self.annotations = []
+
+    def render(self, title: str, ts: pd.DataFrame, output_path: str) -> bool:
+        """
+        以 ts 更新版面並輸出圖檔。
+        :return: 沒有任何可繪製的欄位時回傳 False (不輸出)。
+        """
+        ax = self.ax
+        plotted = [spec for spec in self.series if spec[0] in ts.columns and ts[spec[0]].sum() > 0]
+        if not plotted:
+            return False
+
+        for annotation in self.annotations:
+            annotation.remove()
+        self.annotations = []
+        for line in self.lines.values():
+            line.set_visible(False)
+
+        for column_key, label_text, color, linestyle in plotted:
+            line = self.lines.get(column_key)
+            if line is None:
+                line, = ax.plot(ts.index, ts[column_key], label=label_text, color=color, linestyle=linestyle, marker="o", markersize=5, linewidth=2)
+                self.lines[column_key] = line
+            else:
+                line.set_data(ts.index, ts[column_key])
+                line.set_visible(True)
+            self.annotations.extend(_annotate_series(ax, ts.index, ts[column_key], fontsize=12))
+
+        ax.relim(visible_only=True)
+        ax.autoscale_view()
+        ax.set_title(title)
+        ax.legend(handles=[self.lines[spec[0]] for spec in plotted], loc="upper left")
+        _format_date_axis(ax, dates=ts.index)
+
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        _save_figure(self.fig, output_path)
+        return True
+
+
+_CHART_TEMPLATES = threading.local()
+
+
+def _chart_template(kind: str) -> ChartTemplate:
+    """取得目前執行緒的圖表版面 (每個執行緒、每種圖表各一份)。"""
+    templates = getattr(_CHART_TEMPLATES, "templates", None)
+    if templates is None:
+        templates = _CHART_TEMPLATES.templates = {}
+    if kind not in templates:
+        templates[kind] = ChartTemplate(kind)
+    return templates[kind]
+
+
+def _plot_series_chart(kind: str, region_name: str, ts: pd.DataFrame, output_dir: str) -> None:
     # Only keep the last 5 weeks for plotting
-    ts = ts.tail(5)
+    ts = ts.tail(CHART_WEEKS)
     if ts.empty or ts.sum().sum() == 0:
         return
+
+    _, title_format, series, empty_label = CHART_KINDS[kind]
+    title = title_format.format(region=region_name)
+    output_path, signature = _chart_target(kind, region_name, ts, output_dir)
+    if _chart_is_current(output_path, signature):
+        print(f"⏭️ {output_path} 內容未變動，沿用既有圖檔")
+        return
         
-    plt.figure(figsize=(10, 6))
-    ax = plt.gca()
-
-    plotted_any = False
-    if "禱告" in ts.columns and ts["禱告"].sum() > 0:
-        ax.plot(ts.index, ts["禱告"], label="禱告人數", color="#00aaff", marker="o", markersize=5, linewidth=2)
-        _annotate_series(ax, ts.index, ts["禱告"], fontsize=12)
-        plotted_any = True
-        
-    if "總出訪" in ts.columns and ts["總出訪"].sum() > 0: 
-        ax.plot(ts.index, ts["總出訪"], label="總出訪人數", color="#0044aa", marker="o", markersize=5, linewidth=2)
-        _annotate_series(ax, ts.index, ts["總出訪"], fontsize=12)
-        plotted_any = True
-        
-    if "家受訪" in ts.columns and ts["家受訪"].sum() > 0: # 總結報表中的 '家受訪'
-        ax.plot(ts.index, ts["家受訪"], label="家受訪人數", color="#66ccff", marker="o", markersize=5, linewidth=2)
-        _annotate_series(ax, ts.index, ts["家受訪"], fontsize=12)
-        plotted_any = True
-
-    if not plotted_any:
-        print(f"⚠ {region_name} 沒有可繪製的負擔相關數據")
-        plt.close()
+    # 每個執行緒 (與每個批次子行程) 各自持有一份版面，只更新線條資料、標註與標題
+    if not _chart_template(kind).render(title, ts, output_path):
+        print(f"⚠ {region_name} 沒有可繪製的{empty_label}相關數據")
         return
 
-    ax.set_title(f"{region_name} - 負擔領受程度趨勢 (近五週)")
-    ax.set_xlabel("日期")
-    ax.set_ylabel("人數")
-    ax.legend(loc="upper left")
-    _format_date_axis(ax, dates=ts.index)
-
-    os.makedirs(output_dir, exist_ok=True)
-    output_path = os.path.join(output_dir, f"{region_name}_burden.png")
-    _finalize_plot(plt, output_path)
+    _record_chart_signature(output_path, signature)
     print(f"✅ 已輸出 {output_path}")
 
 
-def generate_region_charts(all_reports: pd.DataFrame, region_name: str, output_dir: str) -> None:
-    """生成指定名稱 (總計, 大區, 或小區) 的圖表"""
-    ts = build_region_timeseries(all_reports, region_name)
+def plot_attendance(region_name: str, ts: pd.DataFrame, output_dir: str) -> None:
+    _plot_series_chart("attendance", region_name, ts, output_dir)
+
+
+def plot_burden(region_name: str, ts: pd.DataFrame, output_dir: str) -> None:
+    _plot_series_chart("burden", region_name, ts, output_dir)
+
+
+def generate_region_charts(all_reports: pd.DataFrame, region_name: str, output_dir: str,
+                           region_timeseries: Optional[Dict[str, pd.DataFrame]] = None) -> None:
+    """
+    生成指定名稱 (總計, 大區, 或小區) 的圖表
+    :param region_timeseries: build_all_region_timeseries 的結果；連續生成多個區域時傳入可避免重複計算。
+    """
+    if region_timeseries is None:
+        region_timeseries = build_all_region_timeseries(all_reports)
+    ts = region_timeseries.get(region_name, pd.DataFrame())
     if ts.empty:
         print(f"⚠ 找不到 {region_name} 的資料，無法繪圖")
         return
@@ -477,6 +1198,61 @@ def generate_region_charts(all_reports: pd.DataFrame, region_name: str, output_d
     plot_burden(region_name, ts, output_dir)
 
 
+# --- 批次繪圖：(區域, 圖表種類) 分派給多個子行程 ---
+# 只用於命令列：每個子行程都會重新匯入整個模組 (約 200MB)，web 行程內請以 max_workers=1 在原執行緒繪製
+CHART_MAX_WORKERS = int(os.environ.get("CHART_MAX_WORKERS", 2))
+
+
+def _render_chart_job(kind: str, region_name: str, ts: pd.DataFrame, output_dir: str) -> str:
+    _plot_series_chart(kind, region_name, ts, output_dir)
+    return f"{region_name}_{CHART_KINDS[kind][0]}"
+
+
+def render_charts_batch(all_reports: pd.DataFrame, region_names: List[str], output_dir: str,
+                        max_workers: int = CHART_MAX_WORKERS) -> int:
+    """
+    批次生成多個區域 (總計 / 大區 / 小區) 的所有圖表。
+    內容未變動的圖表在主行程就先略過，其餘以 ProcessPoolExecutor 平行繪製 (上限 max_workers 個行程)。
+    子行程以 spawn 啟動 (匯入模組時即註冊字體)；max_workers=1 時在呼叫端的執行緒內依序繪製，
+    bot_server 的排程任務與 webhook 都在 512MB 的 web 行程內，一律使用這個模式。
+    :return: 實際重新繪製的圖表數。
+    """
+    region_timeseries = build_all_region_timeseries(all_reports)
+    jobs = []
+    for region_name in dict.fromkeys(region_names):
+        ts = region_timeseries.get(region_name, pd.DataFrame())
+        if ts.empty:
+            print(f"⚠ 找不到 {region_name} 的資料，無法繪圖")
+            continue
+        ts = ts.tail(CHART_WEEKS)
+        if ts.sum().sum() == 0:
+            continue
+        for kind in CHART_KINDS:
+            if not _chart_is_current(*_chart_target(kind, region_name, ts, output_dir)):
+                jobs.append((kind, region_name, ts))
+
+    if not jobs:
+        print("⏭️ 所有圖表內容皆未變動，沿用既有圖檔")
+        return 0
+
+    workers = max(1, min(max_workers, len(jobs)))
+    if workers == 1:
+        for job in jobs:
+            _render_chart_job(*job, output_dir)
+        return len(jobs)
+
+    print(f"🖼️ 以 {workers} 個行程平行繪製 {len(jobs)} 張圖表...")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = {executor.submit(_render_chart_job, *job, output_dir): job for job in jobs}
+        for future in as_completed(futures):
+            kind, region_name, _ = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                print(f"❌ {region_name} ({kind}) 繪圖失敗: {e}")
+    return len(jobs)
+
+
 if __name__ == "__main__":
     base_dir = os.path.dirname(os.path.abspath(__file__))
     
@@ -489,25 +1265,14 @@ if __name__ == "__main__":
         if "區別" not in df_reports.columns:
             raise RuntimeError("匯總後的資料缺少 '區別' 欄位，無法分區生成圖表。")
 
-        # --- 1. 生成 '總計' 圖表 ---
-        generate_region_charts(df_reports, "總計", charts_output_dir)
-        
-        # --- 2. 生成所有自定義的 '大區' 圖表 (如: 高中大區, 青年大區) ---
-        print("\n--- 🌐 開始生成大區圖表 ---")
-        for region_name in REGION_MAPPING.keys():
-            generate_region_charts(df_reports, region_name, charts_output_dir)
-
-        # --- 3. 生成所有 '小區' 圖表 (即 '區別' 欄位中的獨立名稱) ---
-        print("\n--- 💠 開始生成小區圖表 ---")
-        # 僅迭代那些沒有被包含在 REGION_MAPPING 中的獨立小區，或所有小區
-        all_unique_districts = df_reports["區別"].dropna().unique()
-        
-        # 為了避免重複，我們可以選擇只生成未被歸類到大區的小區，或者生成所有小區
+        # 總計、所有自定義的大區 (如: 高中大區, 青年大區)，以及所有小區 (即 '區別' 欄位中的獨立名稱)
         # 這裡選擇生成所有的小區圖表 (即使它被歸類到大區)，以提供最細節的視圖
-        for subdistrict in sorted(all_unique_districts):
-             # 排除總計列 (如果之前沒被移除的話)
-            if not _is_summary_text(subdistrict):
-                generate_region_charts(df_reports, str(subdistrict), charts_output_dir)
+        all_unique_districts = df_reports["區別"].dropna().unique()
+        subdistricts = [str(d) for d in sorted(all_unique_districts) if not _is_summary_text(d)]
+        region_names = ["總計", *REGION_MAPPING.keys(), *subdistricts]
+
+        print(f"\n--- 🌐 開始生成 {len(region_names)} 個區域的圖表 ---")
+        render_charts_batch(df_reports, region_names, charts_output_dir)
             
     except RuntimeError as e:
         print(f"❌ 執行圖表生成失敗: {e}")
\ No newline at end of file
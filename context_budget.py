@@ -0,0 +1,57 @@
+"""
+RAG 提示詞的 token 預算：知識庫大小隨「聖徒數 × 週數」成長，
+組合提示詞時依優先順序逐級降級，直到符合 RAG_TOKEN_BUDGET 為止：
+
+    1. 完整個人明細
+    2. 篩選後的個人明細 (只保留最近幾週)
+    3. 只保留彙總數據 (總結報表 + 出席洞察)
+
+每一級都以「區段名稱 → 文字」的形式提供，分別估算 token 數；
+發生降級時記錄被捨棄或縮減的區段。
+"""
+import os
+from typing import Callable, Dict, List, NamedTuple
+
+RAG_TOKEN_BUDGET = int(os.environ.get("RAG_TOKEN_BUDGET", 24000))
+
+
+class BudgetLevel(NamedTuple):
+    name: str
+    build: Callable[[], Dict[str, str]]  # 延遲建立，只有需要降級時才會計算下一級
+
+
+def _describe_drops(full: Dict[str, int], chosen: Dict[str, int]) -> str:
+    drops = []
+    for section, tokens in full.items():
+        kept = chosen.get(section, 0)
+        if kept == 0:
+            drops.append(f"{section}（{tokens} tokens）")
+        elif kept < tokens:
+            drops.append(f"{section}（{tokens} → {kept} tokens）")
+    return "、".join(drops) if drops else "無"
+
+
+def fit_to_budget(levels: List[BudgetLevel], count_tokens: Callable[[str], int],
+                  reserved_tokens: int = 0, budget: int = RAG_TOKEN_BUDGET) -> str:
+    """
+    依序嘗試各級內容，回傳第一個符合預算的組合；全部超出時回傳最後一級。
+    :param reserved_tokens: 系統提示與問題本身佔用的 token 數。
+    """
+    full_tokens: Dict[str, int] = {}
+    for index, level in enumerate(levels):
+        sections = level.build()
+        tokens = {section: count_tokens(text) for section, text in sections.items() if text}
+        total = reserved_tokens + sum(tokens.values())
+        if index == 0:
+            full_tokens = tokens
+            first_total = total
+
+        is_last = index == len(levels) - 1
+        if total <= budget or is_last:
+            if index > 0:
+                print(f"✂️ 提示詞約 {first_total} tokens，超出預算 {budget}，改用「{level.name}」"
+                      f"(約 {total} tokens)；捨棄：{_describe_drops(full_tokens, tokens)}")
+            if total > budget:
+                print(f"⚠ 降級後仍超出 token 預算 ({total} > {budget})")
+            return "".join(text for text in sections.values() if text)
+    return ""
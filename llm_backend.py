@@ -0,0 +1,122 @@
+"""
+LLM 後端：RAG 回答只透過 LLMBackend.generate() 呼叫模型，不直接依賴 Gemini SDK。
+
+    - GeminiBackend：正式環境使用的 Gemini。
+    - FakeBackend：不連網的本地替身，回答內容固定 (相同提示詞 → 相同回答)，
+      並依提示詞與回答的 token 數模擬延遲，可用於離線量測提示詞大小、快取與路由的效能。
+
+以環境變數 LLM_BACKEND 選擇 ('gemini' 或 'fake')，預設為 gemini。
+"""
+import os
+import re
+import time
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from typing import Optional
+
+try:
+    import google.generativeai as genai
+    GEMINI_SDK_AVAILABLE = True
+except ImportError:
+    print("⚠️ 未安裝 google-generativeai，僅能使用本地 LLM 替身。")
+    GEMINI_SDK_AVAILABLE = False
+
+GEMINI_MODEL_NAME = os.environ.get("GEMINI_MODEL_NAME", "gemini-2.5-flash")
+GEMINI_REQUEST_TIMEOUT_SECONDS = int(os.environ.get("GEMINI_REQUEST_TIMEOUT_SECONDS", 60))
+
+# 本地替身的延遲參數 (秒)：固定開銷 + 每個輸入 token + 每個輸出 token
+FAKE_BASE_LATENCY = float(os.environ.get("FAKE_LLM_BASE_LATENCY", 0.2))
+FAKE_SECONDS_PER_INPUT_TOKEN = float(os.environ.get("FAKE_LLM_SECONDS_PER_INPUT_TOKEN", 0.00002))
+FAKE_SECONDS_PER_OUTPUT_TOKEN = float(os.environ.get("FAKE_LLM_SECONDS_PER_OUTPUT_TOKEN", 0.01))
+FAKE_OUTPUT_TOKENS = 200
+
+_CJK_PATTERN = re.compile(r"[\u3000-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗估 token 數：中日韓字元 (含全形標點) 每字約 1 token，其餘約 4 字元 1 token。"""
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class LLMBackend(ABC):
+    """所有後端共用的介面；子類別必須實作 generate()，否則無法建立實例。"""
+
+    name = "LLM"
+
+    @abstractmethod
+    def generate(self, prompt: str) -> str:
+        """送出提示詞，回傳模型的回答文字。"""
+
+    def count_tokens(self, prompt: str) -> int:
+        return estimate_tokens(prompt)
+
+
+class GeminiBackend(LLMBackend):
+    name = "Gemini"
+
+    def __init__(self, api_key: Optional[str] = None, model_name: str = GEMINI_MODEL_NAME):
+        if not GEMINI_SDK_AVAILABLE:
+            raise RuntimeError("未安裝 google-generativeai")
+        generation_config = {
+            "temperature": 0,  # 設為 0 確保回答一致性
+        }
+        genai.configure(api_key=api_key or os.environ.get("GEMINI_API_KEY"))
+        self._model = genai.GenerativeModel(model_name, generation_config=generation_config)
+
+    def generate(self, prompt: str) -> str:
+        response = self._model.generate_content(prompt, request_options={"timeout": GEMINI_REQUEST_TIMEOUT_SECONDS})
+        return response.text
+
+
+class FakeBackend(LLMBackend):
+    """
+    確定性的本地替身：不連網，延遲 = 固定開銷 + 輸入 token × 單價 + 輸出 token × 單價。
+    calls / prompt_tokens 記錄累計的呼叫次數與輸入 token 數，方便量測快取命中與提示詞大小。
+    """
+
+    name = "FakeLLM"
+
+    def __init__(self, base_latency: float = FAKE_BASE_LATENCY,
+                 seconds_per_input_token: float = FAKE_SECONDS_PER_INPUT_TOKEN,
+                 seconds_per_output_token: float = FAKE_SECONDS_PER_OUTPUT_TOKEN,
+                 output_tokens: int = FAKE_OUTPUT_TOKENS):
+        self.base_latency = base_latency
+        self.seconds_per_input_token = seconds_per_input_token
+        self.seconds_per_output_token = seconds_per_output_token
+        self.output_tokens = output_tokens
+        self.calls = 0
+        self.prompt_tokens = 0
+        self._stats_lock = threading.Lock()
+
+    def simulated_latency(self, prompt_tokens: int) -> float:
+        return (self.base_latency + prompt_tokens * self.seconds_per_input_token
+                + self.output_tokens * self.seconds_per_output_token)
+
+    def generate(self, prompt: str) -> str:
+        prompt_tokens = self.count_tokens(prompt)
+        with self._stats_lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+        time.sleep(self.simulated_latency(prompt_tokens))
+
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+        question = prompt.rsplit("用戶問題：", 1)[-1].strip()
+        return f"（本地模擬回答 {digest}）問題：{question}；提示詞約 {prompt_tokens} tokens。"
+
+
+def create_backend(kind: Optional[str] = None) -> Optional[LLMBackend]:
+    """
+    依 kind (預設讀取環境變數 LLM_BACKEND) 建立後端。
+    Gemini 設定失敗時回傳 None，呼叫端應視為 RAG 功能停用。
+    """
+    kind = (kind or os.environ.get("LLM_BACKEND", "gemini")).lower()
+    if kind == "fake":
+        return FakeBackend()
+    try:
+        return GeminiBackend()
+    except Exception as e:
+        # 如果 API key 未設定或連線失敗，則後端為 None
+        print(f"Gemini 配置失敗，RAG 功能將無法使用: {e}")
+        return None
@@ -0,0 +1,219 @@
+"""
+本地問答引擎：常見、有標準答案的出席問題直接由資料計算，不經過 Gemini。
+
+支援的問題類型：
+    - 上週有來、這週沒來的人 (以及反過來：上週沒來、這週有來)
+    - 某區 / 大區 / 全體 在某週某項目的人數 (例如「高中一區本週主日幾人」)
+    - 連續 N 週沒來某項目的人 (例如「誰連續三週沒來晨興」)
+    - 某週某項目缺席名單 (例如「高中二區誰沒來小排」)
+    - 某位聖徒的逐週出席紀錄 (「查 <姓名>」指令，見 format_member_timeline)
+
+無法辨識的開放式問題回傳 None，由呼叫端改用 generate_rag_response。
+"""
+import re
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+import rag_retrieval
+
+DEFAULT_ACTIVITY = "主日"
+COUNT_ACTIVITIES = ["主日", "禱告", "小排", "晨興"]
+MAX_REPLY_CHARS = 4500  # LINE 單則文字訊息上限為 5000 字
+
+_ABSENT = r"(?:沒來|沒有來|缺席|未到)"
+_PRESENT = r"(?:有來|出席|有到)"
+_WEEK = r"[週周]"
+_DROPPED_PATTERN = re.compile(rf"上{_WEEK}.*{_PRESENT}.*[這本今]{_WEEK}.*{_ABSENT}|[這本今]{_WEEK}.*{_ABSENT}.*上{_WEEK}.*{_PRESENT}")
+_RETURNED_PATTERN = re.compile(rf"上{_WEEK}.*{_ABSENT}.*[這本今]{_WEEK}.*{_PRESENT}|[這本今]{_WEEK}.*{_PRESENT}.*上{_WEEK}.*{_ABSENT}")
+_STREAK_PATTERN = re.compile(rf"連續\s*([0-9一二兩三四五六七八九十]+)\s*{_WEEK}.*{_ABSENT}")
+_COUNT_PATTERN = re.compile(r"幾人|幾個人|幾位|多少人|人數(?:是|有)?(?:多少|幾)|人數\s*[?？]?$")
+# 要求解釋、分析或建議的開放式問題一律交給 Gemini
+_OPEN_ENDED_PATTERN = re.compile(r"為什麼|為何|分析|原因|建議|怎麼辦|如何|趨勢")
+_ABSENT_LIST_PATTERN = re.compile(rf"誰.*{_ABSENT}|{_ABSENT}.*(?:有誰|名單|哪些人|的人)")
+
+
+def _scope_label(query: str, filters: rag_retrieval.QueryFilters, region_mapping: Dict[str, List[str]]) -> str:
+    """問題範圍的顯示名稱：優先使用大區名稱，其次為小區，都沒有則為全體。"""
+    regions = [name for name in region_mapping if name in query]
+    covered = {d for name in regions for d in region_mapping[name]}
+    labels = regions + [d for d in filters.districts if d not in covered]
+    return "、".join(labels) if labels else "全體"
+
+
+def _scoped(df: pd.DataFrame, filters: rag_retrieval.QueryFilters) -> pd.DataFrame:
+    if not filters.districts:
+        return df
+    return df[df["區別"].astype(str).isin(filters.districts)]
+
+
+def _format_name_list(title: str, members: pd.DataFrame) -> str:
+    """依區別分組列出姓名。"""
+    if members.empty:
+        return f"{title}\n（沒有符合的人）"
+
+    lines = [f"{title}（共 {len(members)} 人）"]
+    for district, group in members.groupby("區別", observed=True, sort=True):
+        names = "、".join(group["姓名"].astype(str))
+        lines.append(f"▪ {district}（{len(group)}人）：{names}")
+    text = "\n".join(lines)
+    if len(text) > MAX_REPLY_CHARS:
+        text = text[:MAX_REPLY_CHARS] + "…（名單過長，已截斷）"
+    return text
+
+
+def _week_pivot(df_personal: pd.DataFrame, dates: List[str], activity: str) -> pd.DataFrame:
+    """以 (區別, 姓名) 為列、週次為欄的出席表；該週不在名單中的人為 NaN。"""
+    subset = df_personal[df_personal["日期"].astype(str).isin(dates)]
+    pivot = subset.pivot_table(index=["區別", "姓名"], columns="日期", values=activity,
+                               aggfunc="max", observed=True)
+    pivot.columns = pivot.columns.astype(str)
+    return pivot.reindex(columns=dates)
+
+
+def _answer_week_change(query: str, filters, df_personal, dates, region_mapping, dropped: bool) -> str:
+    if len(dates) < 2:
+        return "⚠️ 目前只有一週的資料，無法比較上週與本週。"
+    activity = filters.activities[0] if filters.activities else DEFAULT_ACTIVITY
+    current, previous = dates[0], dates[1]
+    pivot = _week_pivot(_scoped(df_personal, filters), [current, previous], activity)
+
+    if dropped:
+        mask = (pivot[previous] == 1) & (pivot[current] == 0)
+        title = f"📋 {_scope_label(query, filters, region_mapping)} 上週({previous})有來、本週({current})沒來{activity}的人"
+    else:
+        mask = (pivot[previous] == 0) & (pivot[current] == 1)
+        title = f"📋 {_scope_label(query, filters, region_mapping)} 上週({previous})沒來、本週({current})有來{activity}的人"
+    return _format_name_list(title, pivot[mask].reset_index()[["區別", "姓名"]])
+
+
+def _answer_streak(query: str, filters, df_personal, dates, region_mapping, weeks: int) -> str:
+    if weeks > len(dates):
+        return f"⚠️ 目前只有 {len(dates)} 週的資料，無法判斷連續 {weeks} 週的狀況。"
+    activity = filters.activities[0] if filters.activities else DEFAULT_ACTIVITY
+    recent = dates[:weeks]
+    pivot = _week_pivot(_scoped(df_personal, filters), recent, activity)
+    # 每一週都在名單中，且每一週都沒有出席
+    mask = pivot.notna().all(axis=1) & (pivot.fillna(1) == 0).all(axis=1)
+    title = f"📋 {_scope_label(query, filters, region_mapping)} 連續 {weeks} 週({recent[-1]}～{recent[0]})沒來{activity}的人"
+    return _format_name_list(title, pivot[mask].reset_index()[["區別", "姓名"]])
+
+
+def _answer_absent_list(query: str, filters, df_personal, dates, region_mapping) -> str:
+    activity = filters.activities[0] if filters.activities else DEFAULT_ACTIVITY
+    week = filters.dates[0] if filters.dates else dates[0]
+    subset = _scoped(df_personal, filters)
+    subset = subset[(subset["日期"].astype(str) == week) & (subset[activity] == 0)]
+    title = f"📋 {_scope_label(query, filters, region_mapping)} {week} 沒來{activity}的人"
+    return _format_name_list(title, subset[["區別", "姓名"]].sort_values(["區別", "姓名"]))
+
+
+def _answer_count(query: str, filters, df_summary, region_mapping) -> Optional[str]:
+    if df_summary is None or df_summary.empty:
+        return None
+    summary = _scoped(df_summary, filters)
+    week_strings = pd.to_datetime(summary["週末日"]).dt.strftime("%Y/%m/%d")
+    all_weeks = sorted(pd.to_datetime(df_summary["週末日"]).dt.strftime("%Y/%m/%d").unique(), reverse=True)
+    weeks = filters.dates or all_weeks[:1]
+    activities = [a for a in filters.activities if a in summary.columns] or COUNT_ACTIVITIES
+
+    label = _scope_label(query, filters, region_mapping)
+    lines = []
+    for week in sorted(weeks, reverse=True):
+        week_rows = summary[week_strings == week]
+        if week_rows.empty:
+            lines.append(f"📊 {label} {week}：查無資料")
+            continue
+        counts = "、".join(f"{a} {int(week_rows[a].sum())} 人" for a in activities)
+        lines.append(f"📊 {label} {week}：{counts}")
+    return "\n".join(lines)
+
+
+def personal_timeline(df_personal: Optional[pd.DataFrame], name: str) -> pd.DataFrame:
+    """
+    由個人明細整理出某位聖徒的逐週紀錄，格式同 attendance_db.member_history
+    (出席資料庫無資料時的備援)。
+    """
+    if df_personal is None or df_personal.empty:
+        return pd.DataFrame()
+    rows = df_personal[df_personal["姓名"].astype(str) == name]
+    if rows.empty:
+        return pd.DataFrame()
+    activity_cols = [c for c in COUNT_ACTIVITIES if c in rows.columns]
+    week = pd.to_datetime(rows["日期"].astype(str)).dt.strftime("%Y-%m-%d")
+    timeline = rows[activity_cols].groupby(week.values).max()
+    timeline.insert(0, "區別", rows["區別"].astype(str).groupby(week.values).last())
+    return timeline.sort_index()
+
+
+def format_member_timeline(name: str, timeline: pd.DataFrame, note: Optional[str] = None) -> str:
+    """
+    將某位聖徒的逐週紀錄轉成回覆文字 (✅=出席, ❌=缺席, －=該週不在名單)。
+    :param timeline: index 為週次 'YYYY-MM-DD'，欄位為 '區別' 與各項目。
+    :param note: 附加在標題下方的說明 (例如模糊比對的提示)。
+    """
+    if timeline.empty:
+        return f"🔍 查無 {name} 的出席紀錄。"
+
+    activity_cols = [c for c in COUNT_ACTIVITIES if c in timeline.columns]
+    district = timeline["區別"].dropna().iloc[-1] if "區別" in timeline.columns and timeline["區別"].notna().any() else None
+    title = f"👤 {name}" + (f"（{district}）" if district else " ") + f"近 {len(timeline)} 週出席紀錄"
+    lines = [title]
+    if note:
+        lines.append(note)
+    lines.append("週次｜" + "｜".join(activity_cols))
+    for week, row in timeline.iterrows():
+        marks = ["－" if pd.isna(row[a]) else ("✅" if row[a] else "❌") for a in activity_cols]
+        lines.append(f"{str(week).replace('-', '/')}｜" + "｜".join(marks))
+
+    rates = []
+    for activity in activity_cols:
+        listed = timeline[activity].dropna()
+        rates.append(f"{activity} {int(listed.sum())}/{len(listed)}")
+    lines.append("出席次數：" + "、".join(rates))
+    text = "\n".join(lines)
+    if len(text) > MAX_REPLY_CHARS:
+        text = text[:MAX_REPLY_CHARS] + "…（紀錄過長，已截斷）"
+    return text
+
+
+def answer(query: str, df_summary: Optional[pd.DataFrame], df_personal: Optional[pd.DataFrame],
+           region_mapping: Dict[str, List[str]]) -> Optional[str]:
+    """
+    嘗試直接回答問題。
+    df_personal 只包含期間內至少出席過一次的人，缺席名單與連續缺席因此不會列出早已不再聚會的人。
+    :return: 答案文字；不屬於支援的問題類型時回傳 None。
+    """
+    if _OPEN_ENDED_PATTERN.search(query):
+        return None
+
+    has_personal = df_personal is not None and not df_personal.empty
+    known_names = df_personal["姓名"].astype(str).unique().tolist() if has_personal else []
+    district_sources = [df for df in (df_personal, df_summary) if df is not None]
+    known_districts = sorted({str(d) for df in district_sources for d in df["區別"].dropna().unique()})
+    dates = sorted(df_personal["日期"].astype(str).unique(), reverse=True) if has_personal else []
+
+    filters = rag_retrieval.parse_query(query, known_names, known_districts, region_mapping,
+                                        dates or rag_retrieval.week_dates(None, df_summary))
+    if filters.names:
+        # 個人相關的問題交給 Gemini (或「查 <姓名>」指令)
+        return None
+
+    if has_personal:
+        if _DROPPED_PATTERN.search(query):
+            return _answer_week_change(query, filters, df_personal, dates, region_mapping, dropped=True)
+        if _RETURNED_PATTERN.search(query):
+            return _answer_week_change(query, filters, df_personal, dates, region_mapping, dropped=False)
+        streak_match = _STREAK_PATTERN.search(query)
+        if streak_match:
+            weeks = rag_retrieval.parse_count(streak_match.group(1))
+            if weeks:
+                return _answer_streak(query, filters, df_personal, dates, region_mapping, weeks)
+
+    if _COUNT_PATTERN.search(query):
+        return _answer_count(query, filters, df_summary, region_mapping)
+
+    if has_personal and _ABSENT_LIST_PATTERN.search(query):
+        return _answer_absent_list(query, filters, df_personal, dates, region_mapping)
+
+    return None
@@ -0,0 +1,112 @@
+"""
+聖徒姓名索引：在記憶體中建立歷史上所有聖徒的姓名索引，供「81人數助理 查 <姓名>」指令直接查詢，
+不必讓 Gemini 從知識庫表格中逐列尋找姓名。
+
+比對順序 (找到即停止)：
+    1. 完全相符
+    2. 前綴相符 (只輸入姓氏或前兩個字)
+    3. 模糊相符 (打錯字、少打一字、只輸入名字)
+
+比對前會先做正規化：全形/半形統一、去除空白與間隔號、簡體轉繁體，
+因此「陈柏安」「陳 柏安」都能找到「陳柏安」。
+"""
+import re
+import bisect
+import difflib
+import unicodedata
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+try:
+    from opencc import OpenCC  # 簡繁轉換 (opencc-python-reimplemented)
+    _S2T = OpenCC("s2t")
+except ImportError:
+    print("⚠️ 未安裝 opencc，姓名索引僅使用內建的常見簡繁對照。")
+    _S2T = None
+
+FUZZY_CUTOFF = 0.6
+MAX_CANDIDATES = 5
+
+# 未安裝 opencc 時的備援：常見姓氏與名字用字的簡繁對照
+_FALLBACK_S2T = str.maketrans(
+    "陈张刘杨黄赵吴郑许邓钟谢叶苏卢蒋罗庄萧温冯韩吕孙马钱汤贺龚颜谭骆顾陆"
+    "伟国荣华庆丽凤龙杰亚佳轩宁晓颖维纬诚恺乐锦韵琼灵书兴恩爱",
+    "陳張劉楊黃趙吳鄭許鄧鍾謝葉蘇盧蔣羅莊蕭溫馮韓呂孫馬錢湯賀龔顏譚駱顧陸"
+    "偉國榮華慶麗鳳龍傑亞佳軒寧曉穎維緯誠愷樂錦韻瓊靈書興恩愛",
+)
+# 繁體中的異體字統一成同一個字
+_VARIANT_CHARS = str.maketrans("峯羣衞鍾", "峰群衛鐘")
+_IGNORED_CHARS = re.compile(r"[\s•·‧・．.]+")
+
+
+class NameMatch(NamedTuple):
+    name: str
+    district: Optional[str]
+    kind: str       # 'exact' / 'prefix' / 'fuzzy'
+    score: float    # 1.0 為完全相符
+
+
+def normalize_name(name: str) -> str:
+    """比對用的姓名鍵值 (不用於顯示)。"""
+    key = unicodedata.normalize("NFKC", str(name))
+    key = _IGNORED_CHARS.sub("", key)
+    key = _S2T.convert(key) if _S2T is not None else key.translate(_FALLBACK_S2T)
+    return key.translate(_VARIANT_CHARS).lower()
+
+
+class MemberIndex:
+    """
+    姓名 → 區別 的索引。
+    同一個正規化鍵值可能對應多位同名 (或簡繁不同寫法) 的聖徒，查詢時全部回傳。
+    """
+
+    def __init__(self, members: Iterable[Tuple[str, Optional[str]]]):
+        self._districts: Dict[str, Optional[str]] = {}
+        self._by_key: Dict[str, List[str]] = {}
+        for name, district in members:
+            if not name or name in self._districts:
+                continue
+            self._districts[name] = district
+            self._by_key.setdefault(normalize_name(name), []).append(name)
+        self._keys = sorted(self._by_key)
+
+    def __len__(self) -> int:
+        return len(self._districts)
+
+    def _matches(self, key: str, kind: str, score: float) -> List[NameMatch]:
+        return [NameMatch(name, self._districts[name], kind, score) for name in sorted(self._by_key[key])]
+
+    def lookup(self, query: str, limit: int = MAX_CANDIDATES) -> List[NameMatch]:
+        """
+        依序嘗試完全相符、前綴相符、模糊相符。
+        :return: 最多 limit 筆候選，依相似度由高到低排序；找不到時回傳空清單。
+        """
+        return self.lookup_with_total(query, limit)[0]
+
+    def lookup_with_total(self, query: str, limit: int = MAX_CANDIDATES) -> Tuple[List[NameMatch], int]:
+        """
+        與 lookup 相同，另外回傳截斷前的符合人數 (例如只輸入姓氏時可能有上百人)。
+        :return: (最多 limit 筆候選, 符合的總人數)
+        """
+        key = normalize_name(query)
+        if not key:
+            return [], 0
+
+        if key in self._by_key:
+            exact = self._matches(key, "exact", 1.0)
+            return exact[:limit], len(exact)
+
+        start = bisect.bisect_left(self._keys, key)
+        prefixed = []
+        for candidate in self._keys[start:]:
+            if not candidate.startswith(key):
+                break
+            prefixed.extend(self._matches(candidate, "prefix", len(key) / len(candidate)))
+        if prefixed:
+            prefixed.sort(key=lambda m: -m.score)
+            return prefixed[:limit], len(prefixed)
+
+        fuzzy = []
+        for candidate in difflib.get_close_matches(key, self._keys, n=limit, cutoff=FUZZY_CUTOFF):
+            score = difflib.SequenceMatcher(None, key, candidate).ratio()
+            fuzzy.extend(self._matches(candidate, "fuzzy", score))
+        return fuzzy[:limit], len(fuzzy)
@@ -0,0 +1,205 @@
+"""
+RAG 檢索：依問題內容只挑出相關的資料列，而不是每次都把整份個人明細送給 Gemini。
+
+從問題中解析：
+    - 聖徒姓名 (比對個人明細中出現過的姓名)
+    - 區別 / 大區 (大區會展開成所屬小區)
+    - 日期 (YYYY-MM-DD、MM/DD、本週、上週、上上週、近 N 週)
+    - 項目關鍵字 (主日、禱告、小排、晨興、出訪...)
+
+完全解析不到任何條件時回傳 None，由呼叫端改用完整知識庫。
+"""
+import re
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional
+
+import pandas as pd
+
+PERSONAL_ACTIVITY_COLUMNS = ["主日", "禱告", "小排", "晨興"]
+SUMMARY_ACTIVITY_COLUMNS = ["主日", "禱告", "家出訪", "家受訪", "小排", "晨興", "福出訪"]
+# 關鍵字 → 對應的欄位 ('出訪' 同時涵蓋家出訪與福出訪)
+ACTIVITY_KEYWORDS = {
+    "主日": ["主日"],
+    "禱告": ["禱告"],
+    "小排": ["小排"],
+    "晨興": ["晨興"],
+    "家出訪": ["家出訪"],
+    "家受訪": ["家受訪"],
+    "福出訪": ["福出訪"],
+    "出訪": ["家出訪", "福出訪"],
+    "受訪": ["家受訪"],
+}
+
+_CHINESE_NUMERALS = {"一": 1, "二": 2, "兩": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9, "十": 10}
+_FULL_DATE_PATTERN = re.compile(r"(\d{4})[-/.年](\d{1,2})[-/.月](\d{1,2})")
+_MONTH_DAY_PATTERN = re.compile(r"(?<![\d/.-])(\d{1,2})[/月](\d{1,2})(?![\d/.-])")
+_RELATIVE_PAST_PATTERN = re.compile(r"(上+)[週周禮拜]")
+_CURRENT_WEEK_PATTERN = re.compile(r"[本這今此][週周]")
+_RECENT_WEEKS_PATTERN = re.compile(r"(?:近|最近|過去|連續)\s*([0-9一二兩三四五六七八九十]+)\s*[週周]")
+
+
+class QueryFilters(NamedTuple):
+    names: List[str]
+    districts: List[str]
+    dates: List[str]        # 'YYYY/MM/DD'，與個人明細的 '日期' 欄位格式相同
+    activities: List[str]
+
+    def is_empty(self) -> bool:
+        return not (self.names or self.districts or self.dates or self.activities)
+
+    def describe(self) -> str:
+        parts = []
+        if self.names:
+            parts.append(f"姓名={'、'.join(self.names)}")
+        if self.districts:
+            parts.append(f"區別={'、'.join(self.districts)}")
+        if self.dates:
+            parts.append(f"日期={'、'.join(self.dates)}")
+        if self.activities:
+            parts.append(f"項目={'、'.join(self.activities)}")
+        return "；".join(parts)
+
+
+class RetrievalResult(NamedTuple):
+    filters: QueryFilters
+    summary: Optional[pd.DataFrame]
+    personal: Optional[pd.DataFrame]
+
+
+def parse_count(text: str) -> Optional[int]:
+    if text.isdigit():
+        return int(text)
+    if text == "十":
+        return 10
+    if text.startswith("十"):
+        return 10 + _CHINESE_NUMERALS.get(text[1:], 0)
+    if text.endswith("十"):
+        return _CHINESE_NUMERALS.get(text[:-1], 0) * 10
+    return _CHINESE_NUMERALS.get(text)
+
+
+def _week_sunday(date_value: datetime) -> datetime:
+    """與 app.get_church_week_info 相同：一週從週日開始。"""
+    return date_value - timedelta(days=(date_value.weekday() + 1) % 7)
+
+
+def parse_dates(query: str, available_dates: List[str]) -> List[str]:
+    """
+    將問題中的日期描述對應到資料中實際存在的週次。
+    :param available_dates: 資料中的週次 ('YYYY/MM/DD')，由新到舊排序。
+    """
+    if not available_dates:
+        return []
+
+    selected: List[str] = []
+
+    def add(date_str: str):
+        if date_str in available_dates and date_str not in selected:
+            selected.append(date_str)
+
+    for match in _RECENT_WEEKS_PATTERN.finditer(query):
+        count = parse_count(match.group(1))
+        if count:
+            for date_str in available_dates[:count]:
+                add(date_str)
+
+    if _CURRENT_WEEK_PATTERN.search(query):
+        add(available_dates[0])
+    for match in _RELATIVE_PAST_PATTERN.finditer(query):
+        offset = len(match.group(1))
+        if offset < len(available_dates):
+            add(available_dates[offset])
+
+    latest = datetime.strptime(available_dates[0], "%Y/%m/%d")
+    for match in _FULL_DATE_PATTERN.finditer(query):
+        try:
+            add(_week_sunday(datetime(*map(int, match.groups()))).strftime("%Y/%m/%d"))
+        except ValueError:
+            continue
+    for match in _MONTH_DAY_PATTERN.finditer(_FULL_DATE_PATTERN.sub(" ", query)):
+        month, day = map(int, match.groups())
+        year = latest.year if month <= latest.month else latest.year - 1
+        try:
+            add(_week_sunday(datetime(year, month, day)).strftime("%Y/%m/%d"))
+        except ValueError:
+            continue
+
+    return selected
+
+
+def parse_query(query: str, known_names: List[str], known_districts: List[str],
+                region_mapping: Dict[str, List[str]], available_dates: List[str]) -> QueryFilters:
+    """從問題中解析出姓名、區別、日期與項目條件。"""
+    # 較長的姓名優先比對，避免「王小明」被「王小」之類的短名搶先命中
+    names = []
+    for name in sorted(known_names, key=len, reverse=True):
+        if len(name) >= 2 and name in query and not any(name in found for found in names):
+            names.append(name)
+
+    districts: List[str] = []
+    for region_name, subdistricts in region_mapping.items():
+        if region_name in query:
+            districts.extend(d for d in subdistricts if d not in districts)
+    for district in known_districts:
+        if district in query and district not in districts:
+            districts.append(district)
+
+    activities: List[str] = []
+    for keyword, columns in ACTIVITY_KEYWORDS.items():
+        if keyword in query:
+            activities.extend(c for c in columns if c not in activities)
+
+    return QueryFilters(names, districts, parse_dates(query, available_dates), activities)
+
+
+def week_dates(df_personal: Optional[pd.DataFrame], df_summary: Optional[pd.DataFrame]) -> List[str]:
+    """資料中的週次 ('YYYY/MM/DD')，由新到舊排序；優先取自個人明細。"""
+    if df_personal is not None and not df_personal.empty:
+        dates = df_personal["日期"].astype(str).unique().tolist()
+    elif df_summary is not None and not df_summary.empty:
+        dates = pd.to_datetime(df_summary["週末日"]).dt.strftime("%Y/%m/%d").unique().tolist()
+    else:
+        return []
+    return sorted(dates, reverse=True)
+
+
+def retrieve(query: str, df_summary: Optional[pd.DataFrame], df_personal: Optional[pd.DataFrame],
+             region_mapping: Dict[str, List[str]]) -> Optional[RetrievalResult]:
+    """
+    依問題篩選總結數據與個人明細。
+    :return: 篩選結果；問題中沒有任何可用條件時回傳 None。
+    """
+    known_names = df_personal["姓名"].astype(str).unique().tolist() if df_personal is not None else []
+    district_sources = [df for df in (df_personal, df_summary) if df is not None]
+    known_districts = sorted({str(d) for df in district_sources for d in df["區別"].dropna().unique()})
+
+    filters = parse_query(query, known_names, known_districts, region_mapping,
+                          week_dates(df_personal, df_summary))
+    if filters.is_empty():
+        return None
+
+    summary = None
+    if df_summary is not None and not df_summary.empty:
+        summary = df_summary
+        if filters.districts:
+            summary = summary[summary["區別"].astype(str).isin(filters.districts)]
+        if filters.dates:
+            summary = summary[pd.to_datetime(summary["週末日"]).dt.strftime("%Y/%m/%d").isin(filters.dates)]
+        if filters.activities:
+            keep = [c for c in SUMMARY_ACTIVITY_COLUMNS if c in filters.activities and c in summary.columns]
+            summary = summary[["區別", "週末日"] + keep]
+
+    personal = None
+    if df_personal is not None and not df_personal.empty:
+        personal = df_personal
+        if filters.names:
+            personal = personal[personal["姓名"].astype(str).isin(filters.names)]
+        elif filters.districts:
+            personal = personal[personal["區別"].astype(str).isin(filters.districts)]
+        if filters.dates and not filters.names:
+            personal = personal[personal["日期"].astype(str).isin(filters.dates)]
+        personal_activities = [c for c in PERSONAL_ACTIVITY_COLUMNS if c in filters.activities]
+        if personal_activities:
+            personal = personal[["日期", "區別", "姓名"] + personal_activities]
+
+    return RetrievalResult(filters, summary, personal)